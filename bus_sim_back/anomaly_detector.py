@@ -0,0 +1,174 @@
+import math
+
+from data_sources import DEFAULT_SOURCE_ID
+from derived_jobs import DRIVING_SEGMENT_SQL, finish_job, iter_segment_batches, job_main, run_job_for_source, start_job
+
+# --- Configuration Constants ---
+TEMP_BAND_WIDTH_F = 5        # Segments are normalized against the fleet mean kW of their temperature band
+EWMA_ALPHA = 0.1             # Weight of the newest segment in the per-bus EWMA
+MIN_SAMPLES = 20             # Segments a bus needs before it can be scored
+SEGMENT_Z_THRESHOLD = 3.0    # |z| at or above this flags a segment
+DRIFT_THRESHOLD = 1.0        # EWMA this many std devs above the bus mean flags the bus as drifting
+JOB = 'anomaly_scores'
+SCORING_VERSION = 1          # Bump when scoring changes so stored scores are rebuilt
+
+# Keeps per-bus running statistics (Welford mean/variance and an EWMA) of
+# temperature-normalized energy use, and stores a score for every scored DRIVING
+# segment. Each run only reads segments appended since the previous run; if
+# ingest deleted or rewrote rows (a changed CSV, --rebuild) the job notices and
+# starts over.
+#
+# A run first folds its new segments into the per-band fleet means, then scores
+# them against those fixed means, so every segment in a run (and every segment
+# of a rebuild) is normalized against the same baseline rather than one that
+# moves while the run is scoring. Segments are scored in (date, start_time)
+# order because the EWMA and the z-scores depend on order; if newly ingested
+# segments are older than ones already scored for the same bus, the job
+# rescores everything chronologically.
+
+_TABLES = ['temp_band_stats', 'bus_energy_stats', 'segment_anomaly_scores']
+_KW_SQL = "energy_used_kwh / duration_hours"
+# floor(average_temperature_f / TEMP_BAND_WIDTH_F) without relying on SQLite's optional math functions.
+_BAND_SQL = (f"(CAST(average_temperature_f / {float(TEMP_BAND_WIDTH_F)} AS INTEGER) "
+             f"- (average_temperature_f / {float(TEMP_BAND_WIDTH_F)} "
+             f"< CAST(average_temperature_f / {float(TEMP_BAND_WIDTH_F)} AS INTEGER)))")
+_SCORABLE_SQL = f"{DRIVING_SEGMENT_SQL} AND energy_used_kwh IS NOT NULL AND average_temperature_f IS NOT NULL"
+
+
+# --- Schema ---
+def ensure_anomaly_tables(conn):
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS temp_band_stats (
+            band INTEGER PRIMARY KEY,
+            n INTEGER, mean_kw REAL
+        );
+        CREATE TABLE IF NOT EXISTS bus_energy_stats (
+            bus TEXT PRIMARY KEY,
+            n INTEGER, mean REAL, m2 REAL, ewma REAL,
+            last_date TEXT, drift_score REAL, flagged INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS segment_anomaly_scores (
+            segment_rowid INTEGER PRIMARY KEY,
+            bus TEXT, date TEXT,
+            avg_power_kw REAL, normalized_energy REAL,
+            z_score REAL, ewma REAL, flagged INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS idx_segment_anomaly_flagged ON segment_anomaly_scores (flagged, date);
+        CREATE INDEX IF NOT EXISTS idx_segment_anomaly_bus_date ON segment_anomaly_scores (bus, date);
+    ''')
+
+
+# --- Incremental Update ---
+def _has_backfill(conn, last_rowid, max_rowid):
+    """True if a new segment predates the last segment already scored for its bus."""
+    return conn.execute(f'''
+        SELECT 1
+        FROM operational_segments s
+        JOIN bus_energy_stats b ON b.bus = CAST(s.bus AS TEXT)
+        WHERE s.rowid > ? AND s.rowid <= ? AND {_SCORABLE_SQL}
+          AND substr(s.date, 1, 10) < b.last_date
+        LIMIT 1
+    ''', (last_rowid, max_rowid)).fetchone() is not None
+
+
+def _update_band_means(conn, last_rowid, max_rowid):
+    """Folds segments in (last_rowid, max_rowid] into temp_band_stats. Returns {band: mean_kw}."""
+    bands = {row[0]: [row[1], row[2]] for row in conn.execute("SELECT band, n, mean_kw FROM temp_band_stats")}
+    for band_key, n, kw_sum in conn.execute(f'''
+        SELECT {_BAND_SQL} AS band, COUNT(*), SUM({_KW_SQL})
+        FROM operational_segments
+        WHERE rowid > ? AND rowid <= ? AND {_SCORABLE_SQL}
+        GROUP BY band
+    ''', (last_rowid, max_rowid)):
+        band = bands.setdefault(band_key, [0, 0.0])
+        band[1] = (band[0] * band[1] + kw_sum) / (band[0] + n)
+        band[0] += n
+    conn.executemany(
+        "INSERT OR REPLACE INTO temp_band_stats (band, n, mean_kw) VALUES (?, ?, ?)",
+        [(band_key, band[0], band[1]) for band_key, band in bands.items()]
+    )
+    return {band_key: band[1] for band_key, band in bands.items()}
+
+
+def update_anomaly_scores(conn, rebuild=False):
+    """Scores segments ingested since the last run. Returns the number of new segments read."""
+    ensure_anomaly_tables(conn)
+
+    last_rowid, max_rowid = start_job(conn, JOB, _TABLES, version=SCORING_VERSION, rebuild=rebuild)
+    if last_rowid and _has_backfill(conn, last_rowid, max_rowid):
+        print(f"{JOB}: new segments predate scored ones; rescoring chronologically.")
+        last_rowid, max_rowid = start_job(conn, JOB, _TABLES, version=SCORING_VERSION, rebuild=True)
+
+    band_means = _update_band_means(conn, last_rowid, max_rowid)
+    buses = {
+        row[0]: {'n': row[1], 'mean': row[2], 'm2': row[3], 'ewma': row[4], 'last_date': row[5]}
+        for row in conn.execute("SELECT bus, n, mean, m2, ewma, last_date FROM bus_energy_stats")
+    }
+
+    processed = conn.execute(
+        "SELECT COUNT(*) FROM operational_segments WHERE rowid > ? AND rowid <= ?", (last_rowid, max_rowid)
+    ).fetchone()[0]
+    for rows in iter_segment_batches(
+            conn, ['bus', 'date', _KW_SQL, _BAND_SQL, f"({_SCORABLE_SQL})"],
+            last_rowid, max_rowid, order_by='date, start_time, rowid'):
+        scores = []
+        for rowid, bus, date, kw, band_key, scorable in rows:
+            if not scorable:
+                continue
+            baseline = band_means.get(band_key)
+            if baseline is None or baseline <= 0:
+                continue
+            x = kw / baseline
+
+            bus_key = str(bus)
+            stats = buses.setdefault(bus_key, {'n': 0, 'mean': 0.0, 'm2': 0.0, 'ewma': None, 'last_date': None})
+
+            # Score against the statistics from before this segment.
+            z = None
+            if stats['n'] >= MIN_SAMPLES:
+                std = math.sqrt(stats['m2'] / (stats['n'] - 1))
+                z = (x - stats['mean']) / std if std > 0 else 0.0
+
+            stats['n'] += 1
+            delta = x - stats['mean']
+            stats['mean'] += delta / stats['n']
+            stats['m2'] += delta * (x - stats['mean'])
+            stats['ewma'] = x if stats['ewma'] is None else EWMA_ALPHA * x + (1 - EWMA_ALPHA) * stats['ewma']
+            date_str = str(date)[:10] if date is not None else None
+            if date_str and (stats['last_date'] is None or date_str > stats['last_date']):
+                stats['last_date'] = date_str
+
+            flagged = 1 if z is not None and abs(z) >= SEGMENT_Z_THRESHOLD else 0
+            scores.append((rowid, bus_key, date_str, kw, x, z, stats['ewma'], flagged))
+
+        conn.executemany('''
+            INSERT OR REPLACE INTO segment_anomaly_scores
+                (segment_rowid, bus, date, avg_power_kw, normalized_energy, z_score, ewma, flagged)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', scores)
+
+    bus_rows = []
+    for bus_key, stats in buses.items():
+        drift = None
+        if stats['n'] >= MIN_SAMPLES:
+            std = math.sqrt(stats['m2'] / (stats['n'] - 1))
+            drift = (stats['ewma'] - stats['mean']) / std if std > 0 else 0.0
+        flagged = 1 if drift is not None and drift >= DRIFT_THRESHOLD else 0
+        bus_rows.append((bus_key, stats['n'], stats['mean'], stats['m2'], stats['ewma'], stats['last_date'], drift, flagged))
+    conn.executemany('''
+        INSERT OR REPLACE INTO bus_energy_stats (bus, n, mean, m2, ewma, last_date, drift_score, flagged)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', bus_rows)
+    finish_job(conn, JOB, max_rowid, version=SCORING_VERSION)
+    return processed
+
+
+def run_for_source(source_id=DEFAULT_SOURCE_ID, rebuild=False):
+    return run_job_for_source(
+        source_id, 'operational_segments', update_anomaly_scores, rebuild=rebuild,
+        describe=lambda source, n: f"Anomaly scoring for '{source}': read {n} new segments.")
+
+
+if __name__ == "__main__":
+    job_main("Incrementally update per-bus energy anomaly scores.", run_for_source,
+             "Drop the running statistics and rescore all segments.")
@@ -1,27 +1,53 @@
-from flask import Flask, jsonify, request, render_template
+import time
+_IMPORT_STARTED = time.perf_counter()
+
+from flask import Flask, Response, jsonify, request, render_template, stream_with_context
 import sqlite3
 import os
 import logging
 import json
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from data_sources import DATABASE_PATH, DEFAULT_SOURCE_ID, get_source, list_sources, public_source_info
+from capacity_tracker import NOMINAL_ESS_CAPACITY_KWH, current_capacity_by_bus, stored_charging_efficiency
+from quantile_sketches import METRICS as SKETCH_METRICS, query_percentiles
+from daily_rollup import DEFAULT_WINDOW_DAYS, MAX_WINDOW_DAYS, query_power_timeseries
+from anomaly_detector import JOB as ANOMALY_JOB
+from derived_jobs import job_updated_at
+from exporters import (EXPORT_FORMATS, SIMULATION_COLUMNS, SIMULATION_COLUMN_TYPES, encode_rows, iter_cursor_rows,
+                       iter_simulation_rows, parquet_available, sqlite_column_types)
 
 # --- Configuration & Initialization ---
 app = Flask(__name__, template_folder='templates', static_folder='static')
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
-_APP_DIR = os.path.dirname(os.path.abspath(__file__))
-_DEFAULT_DB_PATH = os.path.join(_APP_DIR, 'fleet_history.db')
-_env_db = (os.environ.get('DATABASE_PATH') or '').strip()
-DATABASE_PATH = _env_db if _env_db else _DEFAULT_DB_PATH
 
 # --- Database Utility ---
+# The main database holds shared settings (bus_parameters, chargers); each data
+# source's operational history lives in its own shard (see data_sources.py).
 def get_db_conn():
     conn = sqlite3.connect(DATABASE_PATH)
     conn.row_factory = sqlite3.Row
     return conn
 
+def get_source_conn(source):
+    conn = sqlite3.connect(source['db_path'])
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def _resolve_source(source_id=None):
+    """Returns (source, error_response) for a source id taken from the request."""
+    source_id = source_id or request.args.get('source') or DEFAULT_SOURCE_ID
+    source = get_source(source_id)
+    if source is None:
+        return None, (jsonify({"error": f"Unknown data source '{source_id}'."}), 404)
+    if not os.path.exists(source['db_path']):
+        return None, (jsonify({"error": "Operational data is unavailable."}), 404)
+    return source, None
+
 # --- Database Initialization ---
-# Creates tables if they don't exist yet
+# Creates tables if they don't exist yet. This runs once per deploy (gunicorn's
+# master process via gunicorn.conf.py, or `flask --app app init-db`), not on
+# every worker boot.
 def init_db():
     try:
         conn = get_db_conn()
@@ -64,7 +90,10 @@ def init_db():
         logger.error(f"Error initializing database: {e}")
 
 
-init_db()
+@app.cli.command('init-db')
+def init_db_command():
+    """Create the app tables and default parameters."""
+    init_db()
 
 # --- HTML Serving Routes ---
 @app.route('/')
@@ -120,9 +149,18 @@ def bus_params():
             return jsonify({"error": str(e)}), 500
 
 
-@app.route('/api/config_presets/princeton', methods=['GET'])
-def config_presets_princeton():
-    conn = get_db_conn()
+# --- Data Source API ---
+@app.route('/api/sources', methods=['GET'])
+def get_sources():
+    return jsonify([public_source_info(source) for source in list_sources()])
+
+
+@app.route('/api/config_presets/<source_id>', methods=['GET'])
+def config_presets(source_id):
+    source, error = _resolve_source(source_id)
+    if error:
+        return error
+    conn = get_source_conn(source)
     cur = conn.cursor()
 
     if not _table_exists(cur, 'operational_segments'):
@@ -171,8 +209,11 @@ def config_presets_princeton():
             suggested_eu_kw = (period_ops.get('total_energy_kwh') or 0) / duration
 
     # Prefer default ESS value from configured parameters to keep behavior stable.
-    cur.execute("SELECT ess_capacity_kwh FROM bus_parameters WHERE id = 1")
-    ess_row = cur.fetchone()
+    main_conn = get_db_conn()
+    ess_row = None
+    if _table_exists(main_conn.cursor(), 'bus_parameters'):
+        ess_row = main_conn.execute("SELECT ess_capacity_kwh FROM bus_parameters WHERE id = 1").fetchone()
+    main_conn.close()
     suggested_ess_kwh = (ess_row['ess_capacity_kwh'] if ess_row else None) or 435
 
     # Suggested charge rate if charging sessions are present in the selected period.
@@ -215,9 +256,9 @@ def config_presets_princeton():
 
     return jsonify({
         "source": {
-            "id": "princeton_fleet",
-            "label": "Princeton Fleet (real-world)",
-            "location": "Princeton, NJ"
+            "id": source['id'],
+            "label": source.get('label') or source['id'],
+            "location": source.get('location')
         },
         "selected_period": {"year": selected_year, "month": selected_month},
         "available_periods": periods,
@@ -288,7 +329,10 @@ def handle_single_charger(charger_id):
 # --- Fleet Analytics API ---
 @app.route('/api/fleet_analytics_data', methods=['GET'])
 def get_fleet_analytics_data():
-    conn = get_db_conn()
+    source, error = _resolve_source()
+    if error:
+        return error
+    conn = get_source_conn(source)
     cur = conn.cursor()
     
     try:
@@ -296,6 +340,7 @@ def get_fleet_analytics_data():
         high_temp = float(request.args.get('high_temp', 200))
         timeseries_buses_str = request.args.get('timeseries_buses', None)
     except (ValueError, TypeError):
+        conn.close()
         return jsonify({"error": "Invalid filter parameters"}), 400
 
     if timeseries_buses_str:
@@ -304,62 +349,36 @@ def get_fleet_analytics_data():
             bus_list = [int(bus.strip()) for bus in timeseries_buses_str.split(',') if bus.strip()]
             # --- MODIFICATION END ---
         except ValueError:
+            conn.close()
             return jsonify({"error": "Invalid bus ID in list. IDs must be integers."}), 400
         
         if not bus_list:
+            conn.close()
             return jsonify({"error": "No buses specified for time-series"}), 400
 
-        placeholders = ','.join(['?'] * len(bus_list))
-        
-        time_series_query = f"""
-            SELECT 
-                bus, 
-                date, 
-                SUM(energy_used_kwh) / NULLIF(SUM(duration_hours), 0) as avg_power_kw, 
-                AVG(average_temperature_f) as avg_temp 
-            FROM operational_segments 
-            WHERE average_temperature_f BETWEEN ? AND ? 
-              AND bus IN ({placeholders})
-              AND activity_type = 'DRIVING' 
-              AND duration_hours > 0 
-            GROUP BY bus, date 
-            ORDER BY bus, date ASC
-        """
-        
-        ts_params = [low_temp, high_temp] + bus_list
-        cur.execute(time_series_query, ts_params)
-        results = [dict(row) for row in cur.fetchall()]
-        conn.close()
-
-        if not results:
-            return jsonify({})
-
-        df = pd.DataFrame(results)
-        df['date'] = pd.to_datetime(df['date'])
-        df = df.sort_values(by=['bus', 'date'])
-        
-        df['moving_avg_power_kw'] = df.groupby('bus')['avg_power_kw'].transform(
-            lambda x: x.rolling(window=7, min_periods=1).mean()
-        )
-        
-        df['date'] = df['date'].dt.strftime('%Y-%m-%d')
-        df['moving_avg_power_kw'] = df['moving_avg_power_kw'].round(2)
-
-        df['moving_avg_power_kw'] = df['moving_avg_power_kw'].fillna(0)
-        df['avg_power_kw'] = df['avg_power_kw'].fillna(0)
-        df['avg_temp'] = df['avg_temp'].fillna(0)
-
-        # In JSON, object keys must be strings. Convert numeric bus IDs to strings for the output keys.
-        df['bus'] = df['bus'].astype(str)
-        bus_list_str = [str(bus_id) for bus_id in bus_list]
+        try:
+            window_days = int(request.args.get('window', DEFAULT_WINDOW_DAYS))
+        except ValueError:
+            conn.close()
+            return jsonify({"error": "window must be an integer number of days."}), 400
+        if not 1 <= window_days <= MAX_WINDOW_DAYS:
+            conn.close()
+            return jsonify({"error": f"window must be between 1 and {MAX_WINDOW_DAYS} days."}), 400
+        # calendar=1: the window covers calendar days, so days without data are not skipped over.
+        calendar = request.args.get('calendar', '').lower() in ('1', 'true', 'yes')
 
+        # Daily averages and the trailing moving average come back from one window-function query.
+        cur = query_power_timeseries(conn, bus_list, low_temp, high_temp, window_days, calendar)
         output_data = {}
-        for bus_id in bus_list_str:
-            bus_data = df[df['bus'] == bus_id].to_dict('records')
-            if bus_data:
-                output_data[bus_id] = bus_data
+        for row in cur:
+            bus_id = str(row['bus'])
+            record = dict(row)
+            record['bus'] = bus_id
+            output_data.setdefault(bus_id, []).append(record)
+        conn.close()
 
-        return jsonify(output_data)
+        # In JSON, object keys must be strings; keep the requested bus order.
+        return jsonify({str(bus_id): output_data[str(bus_id)] for bus_id in bus_list if str(bus_id) in output_data})
 
     # This part remains the same for the snapshot KPIs
     params = {'low_temp': low_temp, 'high_temp': high_temp}
@@ -425,7 +444,313 @@ def get_fleet_analytics_data():
     return jsonify(response_data)
 
 
+# --- Energy Anomaly API ---
+# Reads the tables maintained by anomaly_detector.py; nothing here rescans operational_segments.
+@app.route('/api/anomalies', methods=['GET'])
+def get_energy_anomalies():
+    source, error = _resolve_source()
+    if error:
+        return error
+    limit = request.args.get('limit', default=100, type=int)
+    since = request.args.get('since')  # YYYY-MM-DD, optional
+
+    conn = get_source_conn(source)
+    cur = conn.cursor()
+    if not _table_exists(cur, 'bus_energy_stats'):
+        conn.close()
+        return jsonify({"error": "Anomaly scores have not been computed for this source."}), 404
+
+    cur.execute("""
+        SELECT bus, n AS segments, ROUND(mean, 3) AS mean_normalized_energy, ROUND(ewma, 3) AS ewma,
+               ROUND(drift_score, 2) AS drift_score, last_date
+        FROM bus_energy_stats
+        WHERE flagged = 1
+        ORDER BY drift_score DESC
+    """)
+    flagged_buses = [dict(row) for row in cur.fetchall()]
+
+    day_params = {'limit': limit}
+    day_where = "WHERE flagged = 1"
+    if since:
+        day_where += " AND date >= :since"
+        day_params['since'] = since
+    cur.execute(f"""
+        SELECT bus, date, COUNT(*) AS flagged_segments, ROUND(MAX(z_score), 2) AS max_z_score,
+               ROUND(AVG(avg_power_kw), 2) AS avg_power_kw
+        FROM segment_anomaly_scores
+        {day_where}
+        GROUP BY bus, date
+        ORDER BY date DESC, max_z_score DESC
+        LIMIT :limit
+    """, day_params)
+    flagged_days = [dict(row) for row in cur.fetchall()]
+
+    updated_at = job_updated_at(conn, ANOMALY_JOB)
+    conn.close()
+
+    return jsonify({
+        "source": source['id'],
+        "updated_at": updated_at,
+        "flagged_buses": flagged_buses,
+        "flagged_days": flagged_days
+    })
+
+
+# --- Battery Capacity API ---
+# Reads the monthly aggregates materialized by capacity_tracker.py.
+@app.route('/api/bus_capacity', methods=['GET'])
+def get_bus_capacity():
+    source, error = _resolve_source()
+    if error:
+        return error
+    bus_filter = request.args.get('bus')
+
+    conn = get_source_conn(source)
+    cur = conn.cursor()
+    if not _table_exists(cur, 'bus_capacity_monthly'):
+        conn.close()
+        return jsonify({"error": "Capacity estimates have not been computed for this source."}), 404
+
+    query = "SELECT bus, month, sessions, median_capacity_kwh, p25_capacity_kwh, p75_capacity_kwh FROM bus_capacity_monthly"
+    params = []
+    if bus_filter:
+        query += " WHERE bus = ?"
+        params.append(bus_filter)
+    cur.execute(query + " ORDER BY bus, month", params)
+    trend_rows = [dict(row) for row in cur.fetchall()]
+    current = current_capacity_by_bus(conn)
+    charging_efficiency = stored_charging_efficiency(conn)
+    conn.close()
+
+    buses = {}
+    for row in trend_rows:
+        bus_id = str(row.pop('bus'))
+        for key in ('median_capacity_kwh', 'p25_capacity_kwh', 'p75_capacity_kwh'):
+            row[key] = round(row[key], 1) if row[key] is not None else None
+        entry = buses.setdefault(bus_id, {"current_capacity_kwh": None, "measured_capacity_kwh": None,
+                                          "current_month": None, "trend": []})
+        entry["trend"].append(row)
+    # current_capacity_kwh is capped at nameplate for the simulator; measured_capacity_kwh is not.
+    for bus_id, (month, capacity_kwh, measured_kwh) in current.items():
+        if bus_id in buses:
+            buses[bus_id]["current_capacity_kwh"] = round(capacity_kwh, 1)
+            buses[bus_id]["measured_capacity_kwh"] = round(measured_kwh, 1)
+            buses[bus_id]["current_month"] = month
+
+    return jsonify({
+        "source": source['id'],
+        "nominal_capacity_kwh": NOMINAL_ESS_CAPACITY_KWH,
+        "charging_efficiency": charging_efficiency,
+        "buses": buses
+    })
+
+
+# --- Percentile Analytics API ---
+# Answers p90/p95/p99-style queries by merging the per-(bus, month, temperature band)
+# sketches built by quantile_sketches.py at ingest.
+@app.route('/api/energy_percentiles', methods=['GET'])
+def get_energy_percentiles():
+    source, error = _resolve_source()
+    if error:
+        return error
+    metric = request.args.get('metric', 'avg_power_kw')
+    if metric not in SKETCH_METRICS:
+        return jsonify({"error": f"Unknown metric. Use one of: {', '.join(SKETCH_METRICS)}"}), 400
+    try:
+        quantiles = [float(q) for q in request.args.get('q', '0.9,0.95,0.99').split(',') if q.strip()]
+        low_temp = request.args.get('low_temp', type=float)
+        high_temp = request.args.get('high_temp', type=float)
+    except ValueError:
+        return jsonify({"error": "Invalid filter parameters"}), 400
+    if not quantiles or any(q < 0 or q > 1 for q in quantiles):
+        return jsonify({"error": "Quantiles must be between 0 and 1."}), 400
+    buses = [b.strip() for b in (request.args.get('buses') or '').split(',') if b.strip()]
+
+    conn = get_source_conn(source)
+    if not _table_exists(conn.cursor(), 'energy_quantile_sketches'):
+        conn.close()
+        return jsonify({"error": "Percentile sketches have not been built for this source."}), 404
+    results = query_percentiles(
+        conn, metric, quantiles, buses=buses or None,
+        start_month=request.args.get('start_month'), end_month=request.args.get('end_month'),
+        low_temp=low_temp, high_temp=high_temp,
+        group_by_bus=request.args.get('group_by') == 'bus'
+    )
+    conn.close()
+    return jsonify({"source": source['id'], "metric": metric, "percentiles": results})
+
+
+# --- Bulk Export API ---
+# Exports are streamed: rows come from a cursor (or the posted results) through
+# generators, so memory stays flat regardless of export size.
+def _export_format():
+    fmt = (request.args.get('format') or 'csv').lower()
+    if fmt not in EXPORT_FORMATS:
+        return None, (jsonify({"error": f"Unsupported format. Use one of: {', '.join(EXPORT_FORMATS)}"}), 400)
+    if fmt == 'parquet' and not parquet_available():
+        return None, (jsonify({"error": "Parquet export requires pyarrow, which is not installed."}), 501)
+    return fmt, None
+
+
+def _export_response(fmt, columns, rows, filename, column_types=None):
+    return Response(
+        stream_with_context(encode_rows(fmt, columns, rows, column_types)),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt}"'}
+    )
+
+
+@app.route('/api/export/segments', methods=['GET'])
+def export_segments():
+    source, error = _resolve_source()
+    if error:
+        return error
+    fmt, error = _export_format()
+    if error:
+        return error
+
+    conn = get_source_conn(source)
+    cur = conn.cursor()
+    if not _table_exists(cur, 'operational_segments'):
+        conn.close()
+        return jsonify({"error": "Operational data is unavailable."}), 404
+    cur.execute("PRAGMA table_info(operational_segments)")
+    table_columns = [row['name'] for row in cur.fetchall()]
+
+    requested = [c.strip() for c in (request.args.get('columns') or '').split(',') if c.strip()]
+    unknown = [c for c in requested if c not in table_columns]
+    if unknown:
+        conn.close()
+        return jsonify({"error": f"Unknown columns: {', '.join(unknown)}"}), 400
+    columns = requested or table_columns
+
+    where, params = [], []
+    try:
+        if request.args.get('start_date'):
+            where.append("date >= ?")
+            params.append(request.args['start_date'])
+        if request.args.get('end_date'):
+            where.append("date < date(?, '+1 day')")
+            params.append(request.args['end_date'])
+        if request.args.get('activity_type'):
+            where.append("activity_type = ?")
+            params.append(request.args['activity_type'])
+        if request.args.get('low_temp') is not None:
+            where.append("average_temperature_f >= ?")
+            params.append(float(request.args['low_temp']))
+        if request.args.get('high_temp') is not None:
+            where.append("average_temperature_f <= ?")
+            params.append(float(request.args['high_temp']))
+    except ValueError:
+        conn.close()
+        return jsonify({"error": "Invalid filter parameters"}), 400
+    buses = [b.strip() for b in (request.args.get('buses') or '').split(',') if b.strip()]
+    if buses:
+        where.append(f"CAST(bus AS TEXT) IN ({','.join(['?'] * len(buses))})")
+        params.extend(buses)
+
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+    # Parquet gets a fixed schema, resolved from the filtered rows before the response starts streaming.
+    column_types = None
+    if fmt == 'parquet':
+        column_types = sqlite_column_types(conn, 'operational_segments', columns, where_sql, params)
+    column_sql = ', '.join(f'"{c}"' for c in columns)
+    cur.execute(f"SELECT {column_sql} FROM operational_segments {where_sql} ORDER BY rowid", params)
+
+    def rows():
+        try:
+            yield from iter_cursor_rows(cur)
+        finally:
+            conn.close()
+
+    return _export_response(fmt, columns, rows(), f"{source['id']}_operational_segments", column_types)
+
+
+@app.route('/api/export/simulation', methods=['POST'])
+def export_simulation():
+    """Streams posted runSimulation results (or a sweep of runs) as long-form rows."""
+    fmt, error = _export_format()
+    if error:
+        return error
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not (payload.get('resultsPerBus') or payload.get('runs')):
+        return jsonify({"error": "Expected simulation results with 'resultsPerBus' or 'runs'."}), 400
+    return _export_response(fmt, SIMULATION_COLUMNS, iter_simulation_rows(payload), "simulation_results",
+                            SIMULATION_COLUMN_TYPES)
+
+
+# --- Cross-Agency Comparison API ---
+def _source_driving_summary(source, params):
+    """Aggregates DRIVING segments of one shard. Runs in a worker thread with its own connection."""
+    summary = {"source": public_source_info(source), "buses": 0, "avg_power_kw": None,
+               "avg_economy_kwh_per_mile": None, "avg_temp_f": None}
+    if not summary["source"]["available"]:
+        return summary
+    conn = get_source_conn(source)
+    try:
+        cur = conn.cursor()
+        if not _table_exists(cur, 'operational_segments'):
+            return summary
+        where = "WHERE activity_type = 'DRIVING' AND duration_hours > 0 AND average_temperature_f BETWEEN :low_temp AND :high_temp"
+        if params.get('year') is not None and params.get('month') is not None:
+            where += " AND CAST(strftime('%Y', date) AS INTEGER) = :year AND CAST(strftime('%m', date) AS INTEGER) = :month"
+        cur.execute(f"""
+            SELECT
+                COUNT(DISTINCT bus) AS buses,
+                SUM(energy_used_kwh) AS total_energy_kwh,
+                SUM(duration_hours) AS total_duration_hours,
+                SUM(mileage_miles) AS total_mileage_miles,
+                AVG(average_temperature_f) AS avg_temp_f
+            FROM operational_segments {where}
+        """, params)
+        row = dict(cur.fetchone() or {})
+    finally:
+        conn.close()
+
+    duration = row.get('total_duration_hours') or 0
+    miles = row.get('total_mileage_miles') or 0
+    energy = row.get('total_energy_kwh') or 0
+    summary.update({
+        "buses": int(row.get('buses') or 0),
+        "avg_power_kw": round(energy / duration, 2) if duration > 0 else None,
+        "avg_economy_kwh_per_mile": round(energy / miles, 3) if miles > 0 else None,
+        "avg_temp_f": round(row['avg_temp_f'], 1) if row.get('avg_temp_f') is not None else None,
+    })
+    return summary
+
+
+@app.route('/api/sources/compare', methods=['GET'])
+def compare_sources():
+    try:
+        params = {
+            'low_temp': float(request.args.get('low_temp', -100)),
+            'high_temp': float(request.args.get('high_temp', 200)),
+            'year': request.args.get('year', type=int),
+            'month': request.args.get('month', type=int),
+        }
+    except (ValueError, TypeError):
+        return jsonify({"error": "Invalid filter parameters"}), 400
+
+    requested = [s.strip() for s in (request.args.get('sources') or '').split(',') if s.strip()]
+    if requested:
+        sources = [get_source(source_id) for source_id in requested]
+        if None in sources:
+            return jsonify({"error": "Unknown data source in list."}), 404
+    else:
+        sources = list_sources()
+
+    # Each shard is an independent SQLite file, so shards are queried in parallel.
+    with ThreadPoolExecutor(max_workers=min(8, len(sources)) or 1) as pool:
+        summaries = list(pool.map(lambda s: _source_driving_summary(s, params), sources))
+    return jsonify({"sources": summaries})
+
+
+APP_IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED
+logger.info(f"App module imported in {APP_IMPORT_SECONDS * 1000:.1f} ms")
+
+
 if __name__ == '__main__':
+    init_db()
     if not os.path.exists(DATABASE_PATH):
         logger.error(f"DB not found at {DATABASE_PATH}")
     else:
@@ -0,0 +1,186 @@
+import argparse
+import math
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import date, timedelta
+
+from daily_rollup import DEFAULT_WINDOW_DAYS, power_timeseries_sql, update_daily_rollup
+
+# --- Configuration Constants ---
+DEFAULT_BUSES = 500
+DEFAULT_YEARS = 5
+SEGMENTS_PER_DAY = 6
+SERVICE_DAY_SHARE = 0.85     # Share of days a bus is in service; the rest are gaps in its series
+
+# Benchmarks the fleet analytics time series (`/api/fleet_analytics_data?timeseries_buses=...`)
+# on a synthetic fleet: the old pandas rolling-window path, the window-function
+# query over raw operational_segments, and the same query over the daily rollup.
+# All three must return the same rows before any timing is reported.
+
+
+# --- Synthetic Data ---
+def build_synthetic_db(path, buses=DEFAULT_BUSES, years=DEFAULT_YEARS, seed=7):
+    """operational_segments with the columns the analytics endpoints read, laid out like data_processor's table."""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        DROP TABLE IF EXISTS operational_segments;
+        CREATE TABLE operational_segments (
+            date TIMESTAMP, bus INTEGER, start_time TEXT, activity_type TEXT,
+            energy_used_kwh REAL, duration_hours REAL, mileage_miles REAL, average_temperature_f REAL
+        );
+    ''')
+    start = date(2020, 1, 1)
+    days = 365 * years
+    batch = []
+    for d in range(days):
+        day = start + timedelta(days=d)
+        day_str = f"{day.isoformat()} 00:00:00"
+        season = 50 + 30 * math.sin((d % 365) / 365 * 2 * math.pi)
+        for bus in range(26000, 26000 + buses):
+            if rng.random() > SERVICE_DAY_SHARE:
+                continue
+            for s in range(SEGMENTS_PER_DAY):
+                activity = 'DRIVING' if s % 3 else 'IDLE'
+                duration = rng.uniform(0.2, 2.0)
+                temp = round(season + rng.gauss(0, 8), 1) if rng.random() > 0.02 else None
+                energy = duration * rng.uniform(20, 60) if rng.random() > 0.01 else None
+                batch.append((day_str, bus, f"{5 + s * 3:02d}:00:00", activity,
+                              energy, duration, duration * rng.uniform(8, 14), temp))
+        if len(batch) >= 200000:
+            conn.executemany("INSERT INTO operational_segments VALUES (?, ?, ?, ?, ?, ?, ?, ?)", batch)
+            batch = []
+    conn.executemany("INSERT INTO operational_segments VALUES (?, ?, ?, ?, ?, ?, ?, ?)", batch)
+    conn.commit()
+    return conn
+
+
+# --- Implementations ---
+def pandas_timeseries(conn, bus_list, low_temp, high_temp, window_days=DEFAULT_WINDOW_DAYS):
+    """The time-series path as it was before the rollup: per-day SQL, rolling mean in pandas."""
+    import pandas as pd
+
+    placeholders = ','.join(['?'] * len(bus_list))
+    cur = conn.execute(f"""
+        SELECT bus, date,
+            SUM(energy_used_kwh) / NULLIF(SUM(duration_hours), 0) as avg_power_kw,
+            AVG(average_temperature_f) as avg_temp
+        FROM operational_segments
+        WHERE average_temperature_f BETWEEN ? AND ?
+          AND bus IN ({placeholders})
+          AND activity_type = 'DRIVING'
+          AND duration_hours > 0
+        GROUP BY bus, date
+        ORDER BY bus, date ASC
+    """, [low_temp, high_temp] + list(bus_list))
+    columns = [c[0] for c in cur.description]
+    df = pd.DataFrame(cur.fetchall(), columns=columns)
+    if df.empty:
+        return {}
+    df['date'] = pd.to_datetime(df['date'])
+    df = df.sort_values(by=['bus', 'date'])
+    df['moving_avg_power_kw'] = df.groupby('bus')['avg_power_kw'].transform(
+        lambda x: x.rolling(window=window_days, min_periods=1).mean()
+    )
+    df['date'] = df['date'].dt.strftime('%Y-%m-%d')
+    df['moving_avg_power_kw'] = df['moving_avg_power_kw'].round(2).fillna(0)
+    df['avg_power_kw'] = df['avg_power_kw'].fillna(0)
+    df['avg_temp'] = df['avg_temp'].fillna(0)
+    df['bus'] = df['bus'].astype(str)
+    output = {}
+    for bus_id in (str(b) for b in bus_list):
+        records = df[df['bus'] == bus_id].to_dict('records')
+        if records:
+            output[bus_id] = records
+    return output
+
+
+def sql_timeseries(conn, bus_list, low_temp, high_temp, window_days=DEFAULT_WINDOW_DAYS, use_rollup=True):
+    cur = conn.execute(power_timeseries_sql(len(bus_list), window_days, use_rollup=use_rollup),
+                       [low_temp, high_temp] + list(bus_list))
+    output = {}
+    for bus, day, avg_power, avg_temp, moving in cur:
+        output.setdefault(str(bus), []).append(
+            {'bus': str(bus), 'date': day, 'avg_power_kw': avg_power, 'avg_temp': avg_temp, 'moving_avg_power_kw': moving})
+    return output
+
+
+def _same(expected, actual):
+    if expected.keys() != actual.keys():
+        return False
+    for bus_id, rows in expected.items():
+        other = actual[bus_id]
+        if len(rows) != len(other):
+            return False
+        for a, b in zip(rows, other):
+            if a['date'] != b['date']:
+                return False
+            for key in ('avg_power_kw', 'avg_temp'):
+                if not math.isclose(a[key], b[key], rel_tol=1e-9, abs_tol=1e-9):
+                    return False
+            # Both sides round to 2 dp; allow one unit of disagreement on exact .005 ties.
+            if abs(a['moving_avg_power_kw'] - b['moving_avg_power_kw']) > 0.0100001:
+                return False
+    return True
+
+
+def _timed(fn, repeats):
+    best = None
+    result = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run_benchmark(db_path=None, buses=DEFAULT_BUSES, years=DEFAULT_YEARS, query_buses=50,
+                  low_temp=30, high_temp=70, repeats=3):
+    path = db_path or os.path.join(tempfile.mkdtemp(), 'fleet_timeseries_bench.db')
+    if os.path.exists(path):
+        conn = sqlite3.connect(path)
+        print(f"Using existing database {path}")
+    else:
+        started = time.perf_counter()
+        conn = build_synthetic_db(path, buses, years)
+        print(f"Built {buses} buses x {years} years in {time.perf_counter() - started:.1f}s -> {path}")
+    total = conn.execute("SELECT COUNT(*) FROM operational_segments").fetchone()[0]
+
+    started = time.perf_counter()
+    update_daily_rollup(conn, rebuild=True)
+    cells = conn.execute("SELECT COUNT(*) FROM bus_daily_energy").fetchone()[0]
+    print(f"Rolled up {total:,} segments into {cells:,} daily cells in {time.perf_counter() - started:.1f}s")
+
+    all_buses = [row[0] for row in conn.execute("SELECT DISTINCT bus FROM operational_segments ORDER BY bus")]
+    bus_list = all_buses[:query_buses]
+    cases = [
+        ('pandas (previous)', lambda: pandas_timeseries(conn, bus_list, low_temp, high_temp)),
+        ('SQL window, raw segments', lambda: sql_timeseries(conn, bus_list, low_temp, high_temp, use_rollup=False)),
+        ('SQL window, daily rollup', lambda: sql_timeseries(conn, bus_list, low_temp, high_temp)),
+    ]
+    print(f"Time series for {len(bus_list)} buses, {low_temp}-{high_temp}°F, best of {repeats}:")
+    baseline = None
+    for label, fn in cases:
+        elapsed, result = _timed(fn, repeats)
+        if baseline is None:
+            baseline = (elapsed, result)
+        elif not _same(baseline[1], result):
+            print(f"  {label}: results differ from the pandas path")
+            continue
+        print(f"  {label:<26} {elapsed * 1000:9.1f} ms  ({baseline[0] / elapsed:5.1f}x)")
+    conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the fleet analytics time series on a synthetic fleet.")
+    parser.add_argument("--db", help="Reuse (or create) the synthetic database at this path.")
+    parser.add_argument("--buses", type=int, default=DEFAULT_BUSES)
+    parser.add_argument("--years", type=int, default=DEFAULT_YEARS)
+    parser.add_argument("--query-buses", type=int, default=50, help="Buses requested in one time-series call.")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    run_benchmark(args.db, args.buses, args.years, args.query_buses, repeats=args.repeats)
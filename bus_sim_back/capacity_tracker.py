@@ -0,0 +1,223 @@
+from datetime import datetime
+
+from data_sources import DEFAULT_SOURCE_ID, get_source
+from derived_jobs import finish_job, ingest_generation, job_main, job_state, run_job_for_source
+
+# --- Configuration Constants ---
+NOMINAL_ESS_CAPACITY_KWH = 435   # Same nameplate value as data_processor.BUS_ESS_CAPACITY_KWH
+MIN_SOC_CHANGE_PERCENT = 20      # Short top-ups give noisy capacity estimates
+PLAUSIBLE_RANGE = (0.5, 1.3)     # Estimates outside this fraction of nameplate are dropped
+MIN_SESSIONS_FOR_CURRENT = 5     # A month needs this many sessions to count as a bus's current estimate
+DEFAULT_CHARGING_EFFICIENCY = 0.92  # Share of metered charge energy stored in the cells; set per source
+JOB = 'capacity_estimates'
+ESTIMATOR_VERSION = 1            # Bump when session_capacity_kwh changes so stored months are re-estimated
+
+# Estimates each bus's usable battery capacity from charging sessions:
+#   energy into the battery = (energy_transferred_kwh - auxiliary loads while plugged in) * charging efficiency
+#   capacity ≈ energy into the battery / (SOC change / 100)
+# and materializes robust per-bus monthly aggregates (median and quartiles).
+#
+# Charging efficiency: energy_transferred_kwh is the energy the charger
+# delivered, and part of it never ends up stored in the cells. A depot DC
+# charger's conversion runs at roughly 95% near rated power. Cell resistance,
+# the BMS and battery thermal management cost another ~3% that the auxiliary
+# columns do not cover. 0.95 * 0.97 ≈ 0.92 is the default. It comes from that
+# conversion chain and was not fitted to any fleet's data. An agency that knows
+# its chargers' measured efficiency should set `charging_efficiency` on its
+# data source (data_processor.py --charging-efficiency), and that value is used
+# instead. Months are stored with the efficiency they were estimated with, and a
+# changed setting re-estimates them.
+#
+# Monthly medians are stored as measured. Only current_capacity_kwh, which the
+# simulator uses as the bus's pack size, is capped at nameplate.
+# /api/bus_capacity returns the uncapped measured_capacity_kwh next to it, so a
+# remaining bias in the efficiency shows up instead of being clipped.
+# Each run compares per-(bus, month) session counts with the stored ones and only
+# re-reads the months that changed, so new or backfilled months are picked up
+# without re-estimating the whole history. Months that no longer have any
+# sessions are deleted. When ingest replaces charge summary rows (a corrected
+# CSV can keep its row count) it bumps the charging_sessions generation, and
+# every month is re-estimated.
+
+_AUX_COLUMNS = [
+    'air_compressor_energy_consumption_kwh', 'rear_hvac_energy_consumption_kwh',
+    'lv_access_energy_consumption_kwh', 'electric_heater_energy_consumption_kwh',
+]
+
+
+# --- Schema ---
+def ensure_capacity_tables(conn):
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS bus_capacity_monthly (
+            bus TEXT, month TEXT,
+            raw_sessions INTEGER, sessions INTEGER,
+            median_capacity_kwh REAL, p25_capacity_kwh REAL, p75_capacity_kwh REAL,
+            charging_efficiency REAL,
+            updated_at TEXT,
+            PRIMARY KEY (bus, month)
+        );
+        CREATE INDEX IF NOT EXISTS idx_bus_capacity_monthly_month ON bus_capacity_monthly (month);
+    ''')
+
+
+def _bus_key(bus):
+    """charging_sessions stores bus IDs as REAL (e.g. 26002.0); key them like operational_segments."""
+    if isinstance(bus, float) and bus.is_integer():
+        return str(int(bus))
+    return str(bus)
+
+
+def _percentile(sorted_values, q):
+    """Linear-interpolated percentile (0-1) of an already sorted list."""
+    if not sorted_values:
+        return None
+    pos = (len(sorted_values) - 1) * q
+    lo = int(pos)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+
+def charging_efficiency_for(source):
+    """The source's configured charging_efficiency, or DEFAULT_CHARGING_EFFICIENCY."""
+    value = (source or {}).get('charging_efficiency')
+    if value is None:
+        return DEFAULT_CHARGING_EFFICIENCY
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 < value <= 1:
+        print(f"Warning: ignoring charging_efficiency {value!r} for source '{source['id']}' "
+              f"(must be in (0, 1]); using {DEFAULT_CHARGING_EFFICIENCY}.")
+        return DEFAULT_CHARGING_EFFICIENCY
+    return float(value)
+
+
+def session_capacity_kwh(energy_transferred_kwh, soc_change_percent, aux_kwh=0.0,
+                         charging_efficiency=DEFAULT_CHARGING_EFFICIENCY):
+    """Capacity implied by one charging session, or None if the session is not usable."""
+    if energy_transferred_kwh is None or soc_change_percent is None:
+        return None
+    if soc_change_percent < MIN_SOC_CHANGE_PERCENT:
+        return None
+    into_battery = (energy_transferred_kwh - (aux_kwh or 0.0)) * charging_efficiency
+    estimate = into_battery / (soc_change_percent / 100.0)
+    low, high = PLAUSIBLE_RANGE
+    if not (low * NOMINAL_ESS_CAPACITY_KWH <= estimate <= high * NOMINAL_ESS_CAPACITY_KWH):
+        return None
+    return estimate
+
+
+# --- Incremental Update ---
+def update_capacity_estimates(conn, rebuild=False, charging_efficiency=DEFAULT_CHARGING_EFFICIENCY):
+    """Materializes monthly capacity aggregates for new, changed or removed months. Returns those months."""
+    ensure_capacity_tables(conn)
+    state = job_state(conn, JOB)
+    if state and not rebuild:
+        if state[0] != ESTIMATOR_VERSION:
+            print(f"{JOB}: estimator version changed; re-estimating every month.")
+            rebuild = True
+        elif state[1] != ingest_generation(conn, 'charging_sessions'):
+            print(f"{JOB}: charging_sessions was rewritten since the last run; re-estimating every month.")
+            rebuild = True
+        elif conn.execute("SELECT 1 FROM bus_capacity_monthly WHERE charging_efficiency IS NOT ? LIMIT 1",
+                          (charging_efficiency,)).fetchone():
+            print(f"{JOB}: charging efficiency changed to {charging_efficiency}; re-estimating every month.")
+            rebuild = True
+    if rebuild or not state:
+        conn.execute("DELETE FROM bus_capacity_monthly")
+
+    cols = {row[1] for row in conn.execute("PRAGMA table_info(charging_sessions)")}
+    if not {'bus', 'date', 'energy_transferred_kwh', 'soc_start_percent', 'soc_end_percent'} <= cols:
+        return []
+    aux_sql = " + ".join(f"COALESCE({c}, 0)" for c in _AUX_COLUMNS if c in cols) or "0"
+
+    stored = {(row[0], row[1]): row[2] for row in conn.execute("SELECT bus, month, raw_sessions FROM bus_capacity_monthly")}
+    counts = {}
+    for bus, month, n in conn.execute('''
+        SELECT bus, strftime('%Y-%m', date) AS month, COUNT(*)
+        FROM charging_sessions
+        WHERE date IS NOT NULL AND bus IS NOT NULL
+        GROUP BY bus, month
+    '''):
+        if month:
+            key = (_bus_key(bus), month)
+            counts[key] = counts.get(key, 0) + n
+    changed = {key for key, n in counts.items() if stored.get(key) != n}
+    removed = [key for key in stored if key not in counts]
+    months = sorted({month for _, month in changed} | {month for _, month in removed})
+    if not months:
+        finish_job(conn, JOB, 0, version=ESTIMATOR_VERSION, source_table='charging_sessions')
+        return []
+
+    placeholders = ','.join(['?'] * len(months))
+    cur = conn.execute(f'''
+        SELECT bus, strftime('%Y-%m', date) AS month, energy_transferred_kwh,
+               soc_end_percent - soc_start_percent AS soc_change_percent,
+               {aux_sql} AS aux_kwh
+        FROM charging_sessions
+        WHERE date IS NOT NULL AND strftime('%Y-%m', date) IN ({placeholders})
+    ''', months)
+
+    estimates = {key: [] for key in changed}
+    for bus, month, transferred, soc_change, aux in cur:
+        values = estimates.get((_bus_key(bus), month))
+        if values is None:
+            continue
+        estimate = session_capacity_kwh(transferred, soc_change, aux, charging_efficiency)
+        if estimate is not None:
+            values.append(estimate)
+
+    # The deletes and upserts are committed together by finish_job.
+    conn.executemany("DELETE FROM bus_capacity_monthly WHERE bus = ? AND month = ?", removed)
+    now = datetime.now().isoformat(timespec='seconds')
+    rows = []
+    for (bus, month), values in estimates.items():
+        values.sort()
+        rows.append((bus, month, counts[(bus, month)], len(values),
+                     _percentile(values, 0.5), _percentile(values, 0.25), _percentile(values, 0.75),
+                     charging_efficiency, now))
+    conn.executemany('''
+        INSERT OR REPLACE INTO bus_capacity_monthly
+            (bus, month, raw_sessions, sessions, median_capacity_kwh, p25_capacity_kwh, p75_capacity_kwh,
+             charging_efficiency, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    finish_job(conn, JOB, 0, version=ESTIMATOR_VERSION, source_table='charging_sessions')
+    return months
+
+
+def current_capacity_by_bus(conn):
+    """Latest monthly median per bus among months with enough sessions.
+
+    Returns {bus: (month, capped kWh, measured kWh)}. The capped value never
+    exceeds nameplate and is what the simulator should use as the pack size;
+    the measured value is the median as estimated.
+    """
+    cur = conn.execute('''
+        SELECT bus, month, MIN(median_capacity_kwh, ?), median_capacity_kwh
+        FROM (
+            SELECT bus, month, median_capacity_kwh,
+                   ROW_NUMBER() OVER (PARTITION BY bus ORDER BY month DESC) AS rn
+            FROM bus_capacity_monthly
+            WHERE sessions >= ?
+        )
+        WHERE rn = 1
+    ''', (NOMINAL_ESS_CAPACITY_KWH, MIN_SESSIONS_FOR_CURRENT))
+    return {row[0]: (row[1], row[2], row[3]) for row in cur.fetchall()}
+
+
+def stored_charging_efficiency(conn):
+    """Charging efficiency the stored estimates were computed with, or None if there are none."""
+    row = conn.execute("SELECT MAX(charging_efficiency) FROM bus_capacity_monthly").fetchone()
+    return row[0] if row else None
+
+
+def run_for_source(source_id=DEFAULT_SOURCE_ID, rebuild=False):
+    efficiency = charging_efficiency_for(get_source(source_id))
+    return run_job_for_source(
+        source_id, 'charging_sessions',
+        lambda conn, rebuild: update_capacity_estimates(conn, rebuild, charging_efficiency=efficiency),
+        rebuild=rebuild,
+        describe=lambda source, months: f"Capacity estimates for '{source}': updated {len(months)} month(s).")
+
+
+if __name__ == "__main__":
+    job_main("Incrementally update per-bus battery capacity estimates.", run_for_source,
+             "Recompute every month from scratch.")
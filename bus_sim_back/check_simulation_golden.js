@@ -0,0 +1,111 @@
+// Checks static/js/simulation.js against the golden fixtures written by
+// `python simulation_golden.py generate`.
+//   node check_simulation_golden.js [fixtures.json]
+// runSimulation must match every case; the event-driven engine must match the
+// SOC series, energy totals and trigger slots (its messages are worded by time)
+// for buses whose start SOC is within 0-100%. runSimulation only clamps an
+// out-of-range start at the end of slot 0, which has no event-time equivalent.
+const fs = require('fs');
+const path = require('path');
+const vm = require('vm');
+
+const TOLERANCE = 1e-9;
+const appDir = __dirname;
+const spec = JSON.parse(fs.readFileSync(path.join(appDir, 'simulation_kernel_spec.json'), 'utf8'));
+const fixturesPath = process.argv[2]
+  || path.join(appDir, 'simulation_fixtures', `golden_v${spec.version.split('.')[0]}.json`);
+const golden = JSON.parse(fs.readFileSync(fixturesPath, 'utf8'));
+
+const quiet = { log() {}, warn() {}, error: console.error };
+const context = vm.createContext({ console: quiet, Math, Number, String, Array, Object, Map, Set, JSON, Date });
+context.window = context;
+context.addEventListener = () => {};
+vm.runInContext(
+  fs.readFileSync(path.join(appDir, 'static', 'js', 'simulation.js'), 'utf8')
+    + '\n;globalThis.__engine = { runSimulation, runSimulationEventDriven, SIMULATION_KERNEL_VERSION, SLOTS };',
+  context
+);
+const engine = context.__engine;
+
+function expandInput(input) {
+  const buses = input.runCutData.buses.map(bus => {
+    if (!Array.isArray(bus.schedule)) return { ...bus };
+    const schedule = [];
+    for (const [activity, chargerId, length] of bus.schedule) {
+      const entry = activity === null ? null : { activity, chargerId };
+      for (let i = 0; i < length; i++) schedule.push(entry);
+    }
+    return { ...bus, schedule };
+  });
+  return [{ buses }, input.busParameters, input.availableChargers];
+}
+
+function compare(expected, actual, where = 'result') {
+  if (typeof expected === 'number' && typeof actual === 'number') {
+    return Math.abs(expected - actual) <= TOLERANCE ? null : `${where}: expected ${expected}, got ${actual}`;
+  }
+  if (Array.isArray(expected) && Array.isArray(actual)) {
+    if (expected.length !== actual.length) return `${where}: length ${expected.length} != ${actual.length}`;
+    for (let i = 0; i < expected.length; i++) {
+      const diff = compare(expected[i], actual[i], `${where}[${i}]`);
+      if (diff) return diff;
+    }
+    return null;
+  }
+  if (expected && actual && typeof expected === 'object' && typeof actual === 'object') {
+    const keys = Object.keys(expected).sort();
+    if (keys.join('|') !== Object.keys(actual).sort().join('|')) return `${where}: keys differ`;
+    for (const key of keys) {
+      const diff = compare(expected[key], actual[key], `${where}.${key}`);
+      if (diff) return diff;
+    }
+    return null;
+  }
+  return expected === actual ? null : `${where}: expected ${JSON.stringify(expected)}, got ${JSON.stringify(actual)}`;
+}
+
+function withoutMessages(results, input) {
+  const outOfRange = new Set(input.runCutData.buses
+    .filter(bus => { const soc = Number(bus.startSOC); return Number.isFinite(soc) && (soc < 0 || soc > 100); })
+    .map(bus => String(bus.busId)));
+  const perBus = {};
+  for (const [busId, r] of Object.entries(results.resultsPerBus)) {
+    if (outOfRange.has(busId)) continue;
+    perBus[busId] = {
+      socTimeSeries: r.socTimeSeries,
+      totalEnergyConsumedKWh: r.totalEnergyConsumedKWh,
+      totalEnergyChargedKWh: r.totalEnergyChargedKWh,
+      triggerTimes: r.triggerTimes,
+    };
+  }
+  return { resultsPerBus: perBus, overallErrors: results.overallErrors };
+}
+
+let ok = true;
+if (engine.SIMULATION_KERNEL_VERSION !== golden.kernel_version || spec.version !== golden.kernel_version) {
+  console.error(`Kernel version mismatch: simulation.js ${engine.SIMULATION_KERNEL_VERSION}, `
+    + `spec ${spec.version}, fixtures ${golden.kernel_version}`);
+  ok = false;
+}
+if (engine.SLOTS !== golden.slots) {
+  console.error(`SLOTS mismatch: simulation.js ${engine.SLOTS}, fixtures ${golden.slots}`);
+  ok = false;
+}
+
+const engines = [
+  ['runSimulation', args => engine.runSimulation(...args), r => r],
+  ['runSimulationEventDriven', args => engine.runSimulationEventDriven(...args), withoutMessages],
+];
+for (const [name, run, project] of engines) {
+  let failures = 0;
+  for (const testCase of golden.cases) {
+    const diff = compare(project(testCase.expected, testCase.input), project(run(expandInput(testCase.input)), testCase.input));
+    if (diff) {
+      failures += 1;
+      if (failures <= 5) console.error(`  [${name}] ${testCase.id}: ${diff}`);
+    }
+  }
+  console.log(`${name}: ${golden.cases.length - failures}/${golden.cases.length} cases match`);
+  if (failures) ok = false;
+}
+process.exit(ok ? 0 : 1);
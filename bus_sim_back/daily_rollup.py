@@ -0,0 +1,144 @@
+from data_sources import DEFAULT_SOURCE_ID
+from derived_jobs import DRIVING_SEGMENT_SQL, finish_job, job_is_current, job_main, run_job_for_source, start_job
+
+# --- Configuration Constants ---
+DEFAULT_WINDOW_DAYS = 7
+MAX_WINDOW_DAYS = 365
+JOB = 'daily_rollup'
+
+# Per-bus daily rollup of DRIVING segments for the fleet analytics time series.
+# Cells are (bus, day, 1°F temperature bin) plus a flag for segments whose
+# temperature is exactly the bin's integer value, which is enough to apply the
+# dashboard's whole-degree BETWEEN filter exactly. The daily average and the
+# trailing moving average are then one window-function query over the rollup.
+# Like the other derived tables it is updated incrementally from a rowid
+# watermark as data_processor appends new files, and rebuilt when ingest
+# deletes or rewrites rows.
+
+# floor() for REAL temperatures without relying on SQLite's optional math functions.
+_TEMP_BIN_SQL = ("(CAST(average_temperature_f AS INTEGER) "
+                 "- (average_temperature_f < CAST(average_temperature_f AS INTEGER)))")
+
+
+# --- Schema ---
+def ensure_rollup_tables(conn):
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS bus_daily_energy (
+            bus INTEGER, date TEXT, temp_bin INTEGER, on_bin INTEGER,
+            segments INTEGER, energy_segments INTEGER,
+            energy_kwh REAL, duration_hours REAL, temp_sum REAL,
+            PRIMARY KEY (bus, date, temp_bin, on_bin)
+        ) WITHOUT ROWID;
+    ''')
+
+
+# --- Incremental Update ---
+def update_daily_rollup(conn, rebuild=False):
+    """Adds segments ingested since the last run to their daily cells. Returns the number of new segments read."""
+    ensure_rollup_tables(conn)
+
+    last_rowid, max_rowid = start_job(conn, JOB, ['bus_daily_energy'], rebuild=rebuild)
+    if max_rowid <= last_rowid:
+        return 0
+
+    # energy_segments keeps SUM()'s "NULL when every value is NULL" behaviour across merges.
+    conn.execute(f'''
+        INSERT INTO bus_daily_energy
+            (bus, date, temp_bin, on_bin, segments, energy_segments, energy_kwh, duration_hours, temp_sum)
+        SELECT bus, date(date), {_TEMP_BIN_SQL} AS temp_bin,
+               average_temperature_f = {_TEMP_BIN_SQL} AS on_bin,
+               COUNT(*), COUNT(energy_used_kwh), TOTAL(energy_used_kwh),
+               TOTAL(duration_hours), TOTAL(average_temperature_f)
+        FROM operational_segments
+        WHERE rowid > ? AND rowid <= ?
+          AND {DRIVING_SEGMENT_SQL}
+          AND average_temperature_f IS NOT NULL
+          AND bus IS NOT NULL AND date(date) IS NOT NULL
+        GROUP BY 1, 2, 3, 4
+        ON CONFLICT (bus, date, temp_bin, on_bin) DO UPDATE SET
+            segments = segments + excluded.segments,
+            energy_segments = energy_segments + excluded.energy_segments,
+            energy_kwh = energy_kwh + excluded.energy_kwh,
+            duration_hours = duration_hours + excluded.duration_hours,
+            temp_sum = temp_sum + excluded.temp_sum
+    ''', (last_rowid, max_rowid))
+    processed = conn.execute(
+        "SELECT COUNT(*) FROM operational_segments WHERE rowid > ? AND rowid <= ?", (last_rowid, max_rowid)
+    ).fetchone()[0]
+
+    finish_job(conn, JOB, max_rowid)
+    return processed
+
+
+# --- Query ---
+def power_timeseries_sql(n_buses, window_days=DEFAULT_WINDOW_DAYS, calendar=False, use_rollup=True):
+    """SQL for per-bus daily average power plus a trailing moving average.
+
+    Parameters, in order: low_temp, high_temp, then the bus IDs. With
+    calendar=False the window is the last window_days days that have data (the
+    original pandas rolling(7) behaviour); with calendar=True it is the last
+    window_days calendar days, so gaps shrink the window instead of reaching
+    further back. use_rollup=False reads operational_segments directly, which
+    handles non-integer temperature bounds and a rollup that is not yet built.
+    """
+    placeholders = ','.join(['?'] * n_buses)
+    if use_rollup:
+        # t BETWEEN lo AND hi for whole-degree bounds: bins lo..hi-1, plus readings of exactly hi.
+        daily = f'''
+            SELECT bus, date,
+                   CASE WHEN SUM(energy_segments) > 0 THEN SUM(energy_kwh) END
+                       / NULLIF(SUM(duration_hours), 0) AS avg_power_kw,
+                   SUM(temp_sum) / SUM(segments) AS avg_temp
+            FROM bus_daily_energy
+            WHERE ((temp_bin >= ?1 AND temp_bin < ?2) OR (temp_bin = ?2 AND on_bin = 1))
+              AND bus IN ({placeholders})
+            GROUP BY bus, date
+        '''
+    else:
+        daily = f'''
+            SELECT bus, date(date) AS date,
+                   SUM(energy_used_kwh) / NULLIF(SUM(duration_hours), 0) AS avg_power_kw,
+                   AVG(average_temperature_f) AS avg_temp
+            FROM operational_segments
+            WHERE average_temperature_f BETWEEN ?1 AND ?2
+              AND bus IN ({placeholders})
+              AND {DRIVING_SEGMENT_SQL}
+            GROUP BY bus, date(date)
+        '''
+    if calendar:
+        frame = f"ORDER BY julianday(date) RANGE BETWEEN {int(window_days) - 1} PRECEDING AND CURRENT ROW"
+    else:
+        frame = f"ORDER BY date ROWS BETWEEN {int(window_days) - 1} PRECEDING AND CURRENT ROW"
+    return f'''
+        WITH daily AS ({daily})
+        SELECT bus, date,
+               COALESCE(avg_power_kw, 0) AS avg_power_kw,
+               COALESCE(avg_temp, 0) AS avg_temp,
+               COALESCE(ROUND(AVG(avg_power_kw) OVER w, 2), 0) AS moving_avg_power_kw
+        FROM daily
+        WINDOW w AS (PARTITION BY bus {frame})
+        ORDER BY bus, date
+    '''
+
+
+def query_power_timeseries(conn, buses, low_temp, high_temp, window_days=DEFAULT_WINDOW_DAYS, calendar=False):
+    """Runs power_timeseries_sql, using the rollup whenever it gives the exact answer. Returns the cursor."""
+    use_rollup = (float(low_temp).is_integer() and float(high_temp).is_integer()
+                  and job_is_current(conn, JOB))
+    sql = power_timeseries_sql(len(buses), window_days, calendar, use_rollup)
+    if use_rollup:
+        params = [int(low_temp), int(high_temp)] + list(buses)
+    else:
+        params = [low_temp, high_temp] + list(buses)
+    return conn.execute(sql, params)
+
+
+def run_for_source(source_id=DEFAULT_SOURCE_ID, rebuild=False):
+    return run_job_for_source(
+        source_id, 'operational_segments', update_daily_rollup, rebuild=rebuild,
+        describe=lambda source, n: f"Daily rollup for '{source}': read {n} new segments.")
+
+
+if __name__ == "__main__":
+    job_main("Incrementally update the per-bus daily energy rollup.", run_for_source,
+             "Drop the rollup and rebuild it from every segment.")
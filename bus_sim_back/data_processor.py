@@ -1,7 +1,16 @@
 import pandas as pd
 import os
 import glob
+import argparse
+import hashlib
 import sqlite3 # For SQLite database operations
+from datetime import datetime
+from data_sources import DEFAULT_SOURCE_ID, get_source, register_source
+from derived_jobs import bump_ingest_generation
+from anomaly_detector import run_for_source as run_anomaly_scoring
+from capacity_tracker import run_for_source as run_capacity_tracking
+from quantile_sketches import run_for_source as run_sketch_build
+from daily_rollup import run_for_source as run_daily_rollup
 
 # --- Configuration Constants ---
 BUS_ESS_CAPACITY_KWH = 435  # <<< ADD THIS LINE (Example: 450 kWh)
@@ -137,6 +146,7 @@ def process_charge_summary_data_file(csv_file_path):
         
         # Calculate energy added to battery based on SOC change
         # Uses the global BUS_ESS_CAPACITY_KWH defined at the top of the script
+        # (per-bus measured capacity is tracked separately by capacity_tracker.py)
         df['soc_kwh_added'] = (df['soc_change_percent'] / 100.0) * BUS_ESS_CAPACITY_KWH
         
         # Calculate charging power based on energy added to battery
@@ -177,32 +187,138 @@ def infer_activity_type_ops(df_ops):
     )
     return df_ops
 
-def load_data_to_sqlite(db_path, ops_df, charge_df):
-    """Loads the processed DataFrames into an SQLite database."""
+# --- Incremental Ingest ---
+# A shard is only ever appended to: every CSV that has been loaded is recorded in
+# ingested_files with a hash of its contents, and each row carries the file it
+# came from (source_file). Unchanged files are skipped, new files are appended
+# in (date, bus, start_time) order, and a file whose contents changed has its
+# old rows deleted before the new ones are appended. Deleting rows bumps that
+# table's ingest generation so the derived tables read from it rebuild (see
+# derived_jobs.py); pure appends let them pick up only the new rows.
+SEGMENT_SORT_COLUMNS = ['date', 'bus', 'start_time']
+
+def open_shard(db_path):
+    db_dir = os.path.dirname(db_path)
+    if db_dir and not os.path.exists(db_dir):
+        os.makedirs(db_dir)
+    print(f"\nConnecting to SQLite database: {db_path}")
+    return sqlite3.connect(db_path)
+
+def ensure_ingest_log(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS ingested_files (
+            file_name TEXT PRIMARY KEY,
+            kind TEXT,
+            sha256 TEXT,
+            rows INTEGER,
+            ingested_at TEXT
+        )
+    ''')
+
+def ingested_digests(conn):
+    """{file_name: sha256} for every CSV already loaded into this shard."""
+    ensure_ingest_log(conn)
+    return {row[0]: row[1] for row in conn.execute("SELECT file_name, sha256 FROM ingested_files")}
+
+def file_digest(csv_file_path):
+    digest = hashlib.sha256()
+    with open(csv_file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _table_columns(conn, table):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')]
+
+def needs_full_rebuild(conn):
+    """True for shards built before the ingest log, whose rows have no source_file to replace by."""
+    for table in ('operational_segments', 'charging_sessions'):
+        columns = _table_columns(conn, table)
+        if columns and 'source_file' not in columns:
+            return True
+    return False
+
+def reset_source_tables(conn):
+    """Drops the ingested tables and the ingest log so every CSV is loaded again."""
+    ensure_ingest_log(conn)
+    bump_ingest_generation(conn, 'operational_segments')
+    bump_ingest_generation(conn, 'charging_sessions')
+    conn.execute("DROP TABLE IF EXISTS operational_segments")
+    conn.execute("DROP TABLE IF EXISTS charging_sessions")
+    conn.execute("DELETE FROM ingested_files")
+    conn.commit()
+
+def _sqlite_type(dtype):
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return 'TIMESTAMP'
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return 'INTEGER'
+    if pd.api.types.is_float_dtype(dtype):
+        return 'REAL'
+    return 'TEXT'
+
+def append_rows(conn, table, df, file_names):
+    """Replaces the rows of file_names in table with df. Returns True if existing rows were deleted."""
+    existing = _table_columns(conn, table)
+    replaced = False
+    if existing:
+        placeholders = ','.join(['?'] * len(file_names))
+        if conn.execute(f"SELECT 1 FROM {table} WHERE source_file IN ({placeholders}) LIMIT 1",
+                        file_names).fetchone():
+            bump_ingest_generation(conn, table)
+            conn.execute(f"DELETE FROM {table} WHERE source_file IN ({placeholders})", file_names)
+            replaced = True
+        # Monthly exports occasionally gain a column; add it rather than failing the append.
+        for column in df.columns:
+            if column not in existing:
+                conn.execute(f'ALTER TABLE {table} ADD COLUMN "{column}" {_sqlite_type(df[column].dtype)}')
+    if not df.empty:
+        df.to_sql(table, conn, if_exists='append', index=False)
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_source_file ON {table} (source_file)")
+    return replaced
+
+def load_data_to_sqlite(conn, ops_df, charge_df, files):
+    """Appends the processed DataFrames to one source shard and records files [(name, kind, sha256, rows)]."""
     try:
-        conn = sqlite3.connect(db_path)
-        print(f"\nConnecting to SQLite database: {db_path}")
-
-        if ops_df is not None and not ops_df.empty:
-            ops_df.to_sql('operational_segments', conn, if_exists='replace', index=False)
-            print(f"Loaded {len(ops_df)} rows into 'operational_segments' table.")
+        ops_files = [f[0] for f in files if f[1] == 'ops']
+        charge_files = [f[0] for f in files if f[1] == 'charge']
+
+        if ops_files:
+            if ops_df is not None and not ops_df.empty:
+                sort_by = [c for c in SEGMENT_SORT_COLUMNS if c in ops_df.columns]
+                ops_df = ops_df.sort_values(sort_by, kind='stable')
+            else:
+                ops_df = pd.DataFrame()
+            if append_rows(conn, 'operational_segments', ops_df, ops_files):
+                print("Replaced the rows of changed operational data files.")
+            print(f"Appended {len(ops_df)} rows to 'operational_segments' table.")
         else:
-            print("No operational data to load.")
-
-        if charge_df is not None and not charge_df.empty:
-            charge_df.to_sql('charging_sessions', conn, if_exists='replace', index=False)
-            print(f"Loaded {len(charge_df)} rows into 'charging_sessions' table.")
+            print("No new operational data to load.")
+
+        if charge_files:
+            if charge_df is not None and not charge_df.empty:
+                sort_by = [c for c in ('date', 'bus') if c in charge_df.columns]
+                charge_df = charge_df.sort_values(sort_by, kind='stable')
+            else:
+                charge_df = pd.DataFrame()
+            if append_rows(conn, 'charging_sessions', charge_df, charge_files):
+                print("Replaced the rows of changed charge summary files.")
+            print(f"Appended {len(charge_df)} rows to 'charging_sessions' table.")
         else:
-            print("No charging data to load.")
-
-        conn.close()
-        print("Data successfully loaded to SQLite and connection closed.")
+            print("No new charging data to load.")
+
+        now = datetime.now().isoformat(timespec='seconds')
+        conn.executemany(
+            "INSERT OR REPLACE INTO ingested_files (file_name, kind, sha256, rows, ingested_at) VALUES (?, ?, ?, ?, ?)",
+            [(name, kind, digest, rows, now) for name, kind, digest, rows in files])
+        conn.commit()
+        print("Data successfully loaded to SQLite.")
     except Exception as e:
         print(f"Error loading data to SQLite: {e}")
 
 # --- Configuration ---
 CSV_FILES_DIRECTORY = os.path.join("..", "bus_sim_data", "csv_converted")
-DATABASE_PATH = r"fleet_history.db"  # Will be created in the same directory as the script
+# Each source is ingested into its own shard; the default source keeps using fleet_history.db.
 
 # Keywords to identify file types (adjust if your filenames differ)
 OPS_DATA_KEYWORD = "Summary" # Assumes "Summary" (not "Charge_Summary") indicates operational data
@@ -210,31 +326,68 @@ CHARGE_DATA_KEYWORD = "Charge_Summary"
 
 # --- Main Processing Logic ---
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest monthly CSV exports into a data source's SQLite shard.")
+    parser.add_argument("--source-id", default=DEFAULT_SOURCE_ID, help="Data source (agency) ID to (re)build.")
+    parser.add_argument("--label", help="Display label when registering a new source.")
+    parser.add_argument("--location", help="Location when registering a new source.")
+    parser.add_argument("--charging-efficiency", type=float,
+                        help="Share of charger energy stored in the batteries (0-1], used for capacity estimates.")
+    parser.add_argument("--csv-dir", default=CSV_FILES_DIRECTORY, help="Folder with the source's converted CSV files.")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="Drop the shard's ingested data and load every CSV in --csv-dir again.")
+    args = parser.parse_args()
+
     all_ops_data_list = []
     all_charge_data_list = []
+    new_files = []  # (file_name, kind, sha256, rows) for load_data_to_sqlite
 
     # Use absolute path for glob if running from a different CWD than script location
     script_dir = os.path.dirname(os.path.abspath(__file__))
-    csv_dir_abs_path = os.path.join(script_dir, CSV_FILES_DIRECTORY)
-
+    csv_dir_abs_path = os.path.join(script_dir, args.csv_dir)
+
+    source = get_source(args.source_id)
+    if source is None or args.label or args.location or args.charging_efficiency is not None:
+        if args.charging_efficiency is not None and not 0 < args.charging_efficiency <= 1:
+            parser.error("--charging-efficiency must be in (0, 1].")
+        source = register_source(args.source_id, label=args.label, location=args.location,
+                                 charging_efficiency=args.charging_efficiency)
+    print(f"Data source: {source['id']} -> {source['db_path']}")
+
+    conn = open_shard(source['db_path'])
+    if args.rebuild or needs_full_rebuild(conn):
+        print("Rebuilding the shard from every CSV file.")
+        reset_source_tables(conn)
+    already_ingested = ingested_digests(conn)
 
     print(f"Searching for CSV files in: {csv_dir_abs_path}")
     
-    for csv_file in glob.glob(os.path.join(csv_dir_abs_path, "*.csv")):
+    for csv_file in sorted(glob.glob(os.path.join(csv_dir_abs_path, "*.csv"))):
         filename = os.path.basename(csv_file)
-        print(f"\nProcessing file: {filename}")
+        digest = file_digest(csv_file)
+        if already_ingested.get(filename) == digest:
+            continue
+
+        print(f"\nProcessing {'changed' if filename in already_ingested else 'new'} file: {filename}")
 
         if CHARGE_DATA_KEYWORD.lower() in filename.lower():
             df_charge_single = process_charge_summary_data_file(csv_file)
+            rows = 0
             if df_charge_single is not None and not df_charge_single.empty:
+                df_charge_single['source_file'] = filename
                 all_charge_data_list.append(df_charge_single)
-                print(f"Added {len(df_charge_single)} rows from charge summary: {filename}")
+                rows = len(df_charge_single)
+                print(f"Added {rows} rows from charge summary: {filename}")
+            new_files.append((filename, 'charge', digest, rows))
         # Ensure "Charge_Summary" isn't also caught by the "Summary" keyword for ops data
         elif OPS_DATA_KEYWORD.lower() in filename.lower():
             df_ops_single = process_operational_data_file(csv_file)
+            rows = 0
             if df_ops_single is not None and not df_ops_single.empty:
+                df_ops_single['source_file'] = filename
                 all_ops_data_list.append(df_ops_single)
-                print(f"Added {len(df_ops_single)} rows from operational data: {filename}")
+                rows = len(df_ops_single)
+                print(f"Added {rows} rows from operational data: {filename}")
+            new_files.append((filename, 'ops', digest, rows))
         else:
             print(f"Skipping file (unknown type or does not match keywords): {filename}")
 
@@ -257,9 +410,17 @@ if __name__ == "__main__":
     else:
         print("\nNo charging data was processed.")
 
-    # Load data into SQLite
-    # Make DATABASE_PATH relative to script directory as well
-    db_abs_path = os.path.join(script_dir, DATABASE_PATH)
-    load_data_to_sqlite(db_abs_path, final_ops_df, final_charge_df)
+    # Load data into this source's shard only; other sources are untouched.
+    if new_files:
+        load_data_to_sqlite(conn, final_ops_df, final_charge_df, new_files)
+    else:
+        print("\nEvery CSV file is already ingested; nothing to load.")
+    conn.close()
+
+    # Bring the derived tables (anomaly statistics, capacity estimates, percentile sketches, daily rollup) up to date for this shard.
+    run_anomaly_scoring(source['id'])
+    run_capacity_tracking(source['id'])
+    run_sketch_build(source['id'])
+    run_daily_rollup(source['id'])
 
     print("\n--- Script Finished ---")
\ No newline at end of file
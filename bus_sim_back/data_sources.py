@@ -0,0 +1,111 @@
+import json
+import os
+
+# --- Configuration ---
+# Each agency (data source) keeps its operational history in its own SQLite shard,
+# so queries for one agency never scan another agency's segments and each shard
+# can be re-ingested on its own. Shared app settings (bus_parameters, chargers)
+# stay in the main database at DATABASE_PATH.
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+_DEFAULT_DB_PATH = os.path.join(_APP_DIR, 'fleet_history.db')
+_env_db = (os.environ.get('DATABASE_PATH') or '').strip()
+DATABASE_PATH = _env_db if _env_db else _DEFAULT_DB_PATH
+
+_env_shards = (os.environ.get('SHARDS_DIR') or '').strip()
+SHARDS_DIR = _env_shards if _env_shards else os.path.join(_APP_DIR, 'shards')
+
+_env_registry = (os.environ.get('DATA_SOURCES_PATH') or '').strip()
+REGISTRY_PATH = _env_registry if _env_registry else os.path.join(_APP_DIR, 'data_sources.json')
+
+DEFAULT_SOURCE_ID = 'princeton_fleet'
+
+# The original Princeton fleet keeps living in DATABASE_PATH so existing deploys work unchanged.
+_BUILTIN_SOURCES = [
+    {
+        "id": DEFAULT_SOURCE_ID,
+        "label": "Princeton Fleet (real-world)",
+        "location": "Princeton, NJ",
+        "db_path": DATABASE_PATH,
+    },
+]
+
+# Short aliases accepted in URLs (e.g. /api/config_presets/princeton).
+_SOURCE_ALIASES = {'princeton': DEFAULT_SOURCE_ID}
+
+
+# --- Registry ---
+def _read_registry_file():
+    if not os.path.exists(REGISTRY_PATH):
+        return []
+    try:
+        with open(REGISTRY_PATH, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return []
+    return [s for s in data.get('sources', []) if isinstance(s, dict) and s.get('id')]
+
+
+def shard_path_for(source_id):
+    """Default shard location for a source that does not set an explicit db_path."""
+    return os.path.join(SHARDS_DIR, f"{source_id}.db")
+
+
+def list_sources():
+    """Returns all registered sources (built-ins first), each with a resolved db_path."""
+    sources = {s['id']: dict(s) for s in _BUILTIN_SOURCES}
+    for entry in _read_registry_file():
+        merged = dict(sources.get(entry['id'], {}))
+        merged.update(entry)
+        sources[entry['id']] = merged
+    for source in sources.values():
+        db_path = source.get('db_path') or shard_path_for(source['id'])
+        if not os.path.isabs(db_path):
+            db_path = os.path.join(_APP_DIR, db_path)
+        source['db_path'] = db_path
+    return list(sources.values())
+
+
+def get_source(source_id=None):
+    """Looks up a source by id or alias. Returns None if it is not registered."""
+    source_id = _SOURCE_ALIASES.get(source_id, source_id) or DEFAULT_SOURCE_ID
+    for source in list_sources():
+        if source['id'] == source_id:
+            return source
+    return None
+
+
+def register_source(source_id, label=None, location=None, db_path=None, charging_efficiency=None):
+    """Adds or updates a source in the registry file and returns the resolved entry.
+
+    charging_efficiency is the share of charger energy stored in the buses'
+    batteries, used by capacity_tracker.py (its default applies when unset).
+    """
+    entries = _read_registry_file()
+    entry = next((e for e in entries if e['id'] == source_id), None)
+    if entry is None:
+        entry = {"id": source_id}
+        entries.append(entry)
+    if label:
+        entry['label'] = label
+    if location:
+        entry['location'] = location
+    if db_path:
+        entry['db_path'] = db_path
+    if charging_efficiency is not None:
+        entry['charging_efficiency'] = charging_efficiency
+    if not any(s['id'] == source_id for s in _BUILTIN_SOURCES):
+        entry.setdefault('label', source_id)  # Built-ins keep their own label
+
+    with open(REGISTRY_PATH, 'w', encoding='utf-8') as f:
+        json.dump({"sources": entries}, f, indent=2)
+    return get_source(source_id)
+
+
+def public_source_info(source):
+    """Source fields that are safe to return from the API (no filesystem paths)."""
+    return {
+        "id": source['id'],
+        "label": source.get('label') or source['id'],
+        "location": source.get('location'),
+        "available": os.path.exists(source['db_path']),
+    }
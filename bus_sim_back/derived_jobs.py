@@ -0,0 +1,198 @@
+import argparse
+import sqlite3
+from datetime import datetime
+
+from data_sources import DEFAULT_SOURCE_ID, get_source
+
+# --- Configuration Constants ---
+BATCH_SIZE = 5000
+
+# Bookkeeping shared by the jobs that maintain derived tables in a source's
+# shard (anomaly scores, capacity estimates, quantile sketches, daily rollup).
+# data_processor only appends to operational_segments, so each job keeps one row
+# in derived_job_state with the last rowid it has read and only reads newer rows.
+# Ingest keeps a generation per source table and bumps it whenever it deletes
+# or rewrites rows of that table (a changed CSV, --rebuild); a job that sees a
+# new generation of the table it reads, or fewer rows below its watermark than
+# it counted, rebuilds its tables. The job's own
+# version is stored too, so a job whose algorithm changed rebuilds instead of
+# mixing old and new results.
+
+# The DRIVING segments the analytics endpoints and derived tables are built from.
+DRIVING_SEGMENT_SQL = "activity_type = 'DRIVING' AND duration_hours > 0"
+
+
+def is_driving_segment(activity, duration):
+    """Python form of DRIVING_SEGMENT_SQL."""
+    return activity == 'DRIVING' and duration is not None and duration > 0
+
+
+# --- Schema ---
+def ensure_job_state(conn):
+    # execute() rather than executescript(), which would commit the caller's open transaction.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS derived_job_state (
+            job TEXT PRIMARY KEY,
+            version INTEGER,
+            last_rowid INTEGER,
+            row_count INTEGER,
+            ingest_generation INTEGER,
+            updated_at TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS ingest_state (
+            source_table TEXT PRIMARY KEY,
+            generation INTEGER,
+            updated_at TEXT
+        )
+    ''')
+
+
+def _has_table(conn, table):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)
+    ).fetchone() is not None
+
+
+def ingest_generation(conn, source_table='operational_segments'):
+    """Current ingest generation of source_table; 0 before ingest has recorded one."""
+    if not _has_table(conn, 'ingest_state'):
+        return 0
+    row = conn.execute("SELECT generation FROM ingest_state WHERE source_table = ?", (source_table,)).fetchone()
+    return row[0] if row else 0
+
+
+def bump_ingest_generation(conn, source_table):
+    """Called by ingest before it deletes or rewrites rows of source_table. Does not commit."""
+    ensure_job_state(conn)
+    generation = ingest_generation(conn, source_table) + 1
+    conn.execute(
+        "INSERT OR REPLACE INTO ingest_state (source_table, generation, updated_at) VALUES (?, ?, ?)",
+        (source_table, generation, datetime.now().isoformat(timespec='seconds')))
+    return generation
+
+
+def _max_rowid(conn):
+    return conn.execute("SELECT MAX(rowid) FROM operational_segments").fetchone()[0] or 0
+
+
+def _row_count(conn, max_rowid):
+    if not max_rowid:
+        return 0
+    return conn.execute("SELECT COUNT(*) FROM operational_segments WHERE rowid <= ?", (max_rowid,)).fetchone()[0]
+
+
+# --- Job Runs ---
+def start_job(conn, job, tables, version=1, rebuild=False):
+    """Returns (last_rowid, max_rowid): the operational_segments rowid range the job still has to read.
+
+    Clears `tables` first when a rebuild is requested, the job has never run,
+    its version changed, or rows it already read were deleted or rewritten.
+    """
+    ensure_job_state(conn)
+    state = conn.execute(
+        "SELECT version, last_rowid, row_count, ingest_generation FROM derived_job_state WHERE job = ?", (job,)
+    ).fetchone()
+    last_rowid = 0
+    if state and not rebuild:
+        last_rowid = state[1] or 0
+        if state[0] != version:
+            print(f"{job}: version changed ({state[0]} -> {version}); rebuilding.")
+            rebuild = True
+        elif state[3] != ingest_generation(conn):
+            print(f"{job}: operational_segments was rewritten since the last run; rebuilding.")
+            rebuild = True
+        elif _row_count(conn, last_rowid) != state[2]:
+            print(f"{job}: segments already read were deleted; rebuilding.")
+            rebuild = True
+    if rebuild or not state:
+        for table in tables:
+            conn.execute(f"DELETE FROM {table}")
+        last_rowid = 0
+    return last_rowid, _max_rowid(conn)
+
+
+def finish_job(conn, job, max_rowid, version=1, source_table='operational_segments'):
+    """Records that the job has read every segment up to max_rowid, and commits.
+
+    Jobs that read another table (capacity estimates read charging_sessions)
+    pass it as source_table so its ingest generation is the one recorded.
+    """
+    conn.execute('''
+        INSERT OR REPLACE INTO derived_job_state
+            (job, version, last_rowid, row_count, ingest_generation, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (job, version, max_rowid, _row_count(conn, max_rowid), ingest_generation(conn, source_table),
+          datetime.now().isoformat(timespec='seconds')))
+    conn.commit()
+
+
+def job_is_current(conn, job, version=1):
+    """True when the job has read every row of operational_segments in the current ingest generation."""
+    if not _has_table(conn, 'derived_job_state'):
+        return False
+    state = conn.execute(
+        "SELECT version, last_rowid, ingest_generation FROM derived_job_state WHERE job = ?", (job,)
+    ).fetchone()
+    if not state or state[0] != version:
+        return False
+    return state[1] == _max_rowid(conn) and state[2] == ingest_generation(conn)
+
+
+def job_state(conn, job):
+    """(version, ingest_generation) recorded by the job's last run, or None if it has not run."""
+    ensure_job_state(conn)
+    return conn.execute("SELECT version, ingest_generation FROM derived_job_state WHERE job = ?", (job,)).fetchone()
+
+
+def job_updated_at(conn, job):
+    if not _has_table(conn, 'derived_job_state'):
+        return None
+    row = conn.execute("SELECT updated_at FROM derived_job_state WHERE job = ?", (job,)).fetchone()
+    return row[0] if row else None
+
+
+def iter_segment_batches(conn, columns, last_rowid, max_rowid, batch_size=BATCH_SIZE, order_by='rowid'):
+    """Yields lists of (rowid, *columns) for segments in (last_rowid, max_rowid], in rowid order by default."""
+    cur = conn.execute(f'''
+        SELECT rowid, {', '.join(columns)}
+        FROM operational_segments
+        WHERE rowid > ? AND rowid <= ?
+        ORDER BY {order_by}
+    ''', (last_rowid, max_rowid))
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        yield rows
+
+
+# --- Command Line ---
+def run_job_for_source(source_id, table, update, describe, rebuild=False):
+    """Opens a source's shard and runs update(conn, rebuild=...) if `table` exists.
+
+    describe(source_id, result) returns the summary line to print.
+    """
+    source = get_source(source_id)
+    if source is None:
+        print(f"Error: unknown data source '{source_id}'.")
+        return None
+    conn = sqlite3.connect(source['db_path'])
+    try:
+        if not _has_table(conn, table):
+            print(f"No {table} table in {source['db_path']}; nothing to do.")
+            return None
+        result = update(conn, rebuild=rebuild)
+        print(describe(source['id'], result))
+        return result
+    finally:
+        conn.close()
+
+
+def job_main(description, run_for_source, rebuild_help):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--source-id", default=DEFAULT_SOURCE_ID, help="Data source (agency) ID to update.")
+    parser.add_argument("--rebuild", action="store_true", help=rebuild_help)
+    args = parser.parse_args()
+    run_for_source(args.source_id, rebuild=args.rebuild)
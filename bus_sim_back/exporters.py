@@ -0,0 +1,174 @@
+import csv
+import io
+import json
+
+# --- Streaming Export Helpers ---
+# Each encoder takes column names and an iterator of row tuples and yields
+# encoded chunks, so a Flask Response can stream an export of any size while
+# only CHUNK_ROWS rows are held in memory at a time.
+CHUNK_ROWS = 1000
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def parquet_available():
+    try:
+        import pyarrow  # noqa: F401  Optional dependency, only needed for Parquet exports.
+        return True
+    except ImportError:
+        return False
+
+
+def _chunks(rows, size=CHUNK_ROWS):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_csv(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for chunk in _chunks(rows):
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def iter_ndjson(columns, rows):
+    for chunk in _chunks(rows):
+        yield ''.join(json.dumps(dict(zip(columns, row)), default=str) + '\n' for row in chunk)
+
+
+def _coerce(kind, value):
+    if value is None:
+        return None
+    if kind == 'integer':
+        return int(value)
+    if kind == 'real':
+        return float(value)
+    return value.hex() if isinstance(value, bytes) else str(value)
+
+
+def iter_parquet(columns, rows, column_types):
+    """Writes one Parquet row group per chunk and yields the bytes as they are produced.
+
+    The schema comes from column_types ('integer', 'real' or 'text' per column)
+    rather than from the first chunk, so every chunk has the same column types.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    arrow_types = {'integer': pa.int64(), 'real': pa.float64(), 'text': pa.string()}
+    schema = pa.schema([(c, arrow_types[t]) for c, t in zip(columns, column_types)])
+    buffer = io.BytesIO()
+    writer = pq.ParquetWriter(buffer, schema)
+    for chunk in _chunks(rows, size=CHUNK_ROWS * 50):
+        data = {
+            column: [_coerce(kind, row[i]) for row in chunk]
+            for i, (column, kind) in enumerate(zip(columns, column_types))
+        }
+        writer.write_table(pa.Table.from_pydict(data, schema=schema))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    writer.close()
+    yield buffer.getvalue()
+
+
+def encode_rows(fmt, columns, rows, column_types=None):
+    if fmt == 'csv':
+        return iter_csv(columns, rows)
+    if fmt == 'ndjson':
+        return iter_ndjson(columns, rows)
+    if fmt == 'parquet':
+        return iter_parquet(columns, rows, column_types or ['text'] * len(columns))
+    raise ValueError(f"Unsupported export format '{fmt}'")
+
+
+def sqlite_column_types(conn, table, columns, where_sql="", params=()):
+    """Export type per column: the declared SQLite type, widened to what is actually stored.
+
+    SQLite only applies type affinity, so a column declared INTEGER can still
+    hold REAL or TEXT values. One pass over the rows being exported (pass the
+    export's own WHERE clause and parameters) checks the storage classes
+    before anything is streamed.
+    """
+    declared = {row[1]: (row[2] or '').upper() for row in conn.execute(f'PRAGMA table_info("{table}")')}
+    types = []
+    for column in columns:
+        decl = declared.get(column, '')
+        if 'INT' in decl:
+            types.append('integer')
+        elif any(k in decl for k in ('REAL', 'FLOA', 'DOUB', 'NUMERIC', 'DECIMAL')):
+            types.append('real')
+        else:
+            types.append('text')
+
+    numeric = [i for i, t in enumerate(types) if t != 'text']
+    if numeric:
+        checks = []
+        for i in numeric:
+            checks.append(f"""MAX(typeof("{columns[i]}") IN ('text', 'blob'))""")
+            checks.append(f"""MAX(typeof("{columns[i]}") = 'real')""")
+        stored = conn.execute(f'SELECT {", ".join(checks)} FROM "{table}" {where_sql}', params).fetchone()
+        for n, i in enumerate(numeric):
+            if stored[2 * n]:
+                types[i] = 'text'
+            elif stored[2 * n + 1] and types[i] == 'integer':
+                types[i] = 'real'
+    return types
+
+
+# --- Row Generators ---
+def iter_cursor_rows(cur, batch_size=CHUNK_ROWS):
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            yield tuple(row)
+
+
+SIMULATION_COLUMNS = ['run', 'bus_id', 'slot', 'minute', 'soc_percent', 'trigger',
+                      'total_energy_consumed_kwh', 'total_energy_charged_kwh']
+SIMULATION_COLUMN_TYPES = ['text', 'text', 'integer', 'integer', 'real', 'text', 'real', 'real']
+
+
+def _number_or_none(value):
+    """Diesel buses report 'N/A' instead of SOC and energy figures; export those as nulls."""
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+def iter_simulation_rows(payload, slot_minutes=15):
+    """Long-form rows for one runSimulation result or a sweep of them.
+
+    Accepts {"resultsPerBus": {...}} or {"runs": [{"label": ..., "resultsPerBus": {...}}, ...]}.
+    Each row is one SOC sample; `trigger` names the low/critical/stranded trigger
+    that fired in that slot, if any.
+    Non-numeric SOC values and totals ('N/A' for Diesel buses) are exported as nulls.
+    """
+    runs = payload.get('runs') if isinstance(payload.get('runs'), list) else [payload]
+    for index, run in enumerate(runs):
+        label = run.get('label', index) if isinstance(run, dict) else index
+        for bus_id, result in ((run or {}).get('resultsPerBus') or {}).items():
+            triggers = {}
+            for name, slot in (result.get('triggerTimes') or {}).items():
+                if slot is not None:
+                    triggers.setdefault(slot, name)
+            consumed = _number_or_none(result.get('totalEnergyConsumedKWh'))
+            charged = _number_or_none(result.get('totalEnergyChargedKWh'))
+            for slot, soc in enumerate(result.get('socTimeSeries') or []):
+                yield (label, bus_id, slot, slot * slot_minutes, _number_or_none(soc), triggers.get(slot), consumed, charged)
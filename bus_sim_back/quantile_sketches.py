@@ -0,0 +1,229 @@
+import json
+import math
+
+from data_sources import DEFAULT_SOURCE_ID
+from derived_jobs import finish_job, is_driving_segment, iter_segment_batches, job_main, run_job_for_source, start_job
+
+# --- Configuration Constants ---
+RELATIVE_ACCURACY = 0.01     # Quantile estimates are within 1% of the true value
+TEMP_BAND_WIDTH_F = 10       # Rollup cells are (metric, bus, month, 10°F temperature band)
+METRICS = ('avg_power_kw', 'kwh_per_mile')
+JOB = 'quantile_sketches'
+
+# Percentile analytics over DRIVING segments. At ingest every segment is added
+# to a small mergeable sketch for its (bus, month, temperature band) cell, and a
+# query for any range of buses, months and temperatures merges the matching
+# cells instead of sorting raw segments. The sketch is a DDSketch-style
+# log-bucketed histogram: merging is exact and every quantile it returns is
+# within RELATIVE_ACCURACY of a value that actually lies at that rank.
+
+
+class QuantileSketch:
+    """Mergeable quantile sketch with relative-error guarantees."""
+
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zero_count = 0
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def _key(self, value):
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def _value(self, key):
+        return 2 * self._gamma ** key / (self._gamma + 1)
+
+    def add(self, value):
+        if value is None or math.isnan(value):
+            return
+        if value > 0:
+            key = self._key(value)
+            self.positive[key] = self.positive.get(key, 0) + 1
+        elif value < 0:
+            key = self._key(-value)
+            self.negative[key] = self.negative.get(key, 0) + 1
+        else:
+            self.zero_count += 1
+        self.count += 1
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different relative accuracy.")
+        for key, n in other.positive.items():
+            self.positive[key] = self.positive.get(key, 0) + n
+        for key, n in other.negative.items():
+            self.negative[key] = self.negative.get(key, 0) + n
+        self.zero_count += other.zero_count
+        self.count += other.count
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        return self
+
+    def quantile(self, q):
+        """Estimated value at quantile q (0-1), or None for an empty sketch."""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        estimate = None
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                estimate = -self._value(key)
+                break
+        if estimate is None:
+            seen += self.zero_count
+            if seen > rank:
+                estimate = 0.0
+        if estimate is None:
+            for key in sorted(self.positive):
+                seen += self.positive[key]
+                if seen > rank:
+                    estimate = self._value(key)
+                    break
+        if estimate is None:
+            estimate = self.max
+        return min(max(estimate, self.min), self.max)
+
+    def to_json(self):
+        return json.dumps({
+            "a": self.relative_accuracy, "z": self.zero_count, "min": self.min, "max": self.max,
+            "p": self.positive, "n": self.negative,
+        }, separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, text):
+        data = json.loads(text)
+        sketch = cls(data["a"])
+        sketch.positive = {int(k): v for k, v in data["p"].items()}
+        sketch.negative = {int(k): v for k, v in data["n"].items()}
+        sketch.zero_count = data["z"]
+        sketch.count = sketch.zero_count + sum(sketch.positive.values()) + sum(sketch.negative.values())
+        sketch.min = data["min"]
+        sketch.max = data["max"]
+        return sketch
+
+
+# --- Schema ---
+def ensure_sketch_tables(conn):
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS energy_quantile_sketches (
+            metric TEXT, bus TEXT, month TEXT, temp_band INTEGER,
+            count INTEGER, sketch TEXT,
+            PRIMARY KEY (metric, month, bus, temp_band)
+        );
+        CREATE INDEX IF NOT EXISTS idx_energy_sketches_bus ON energy_quantile_sketches (metric, bus, month);
+    ''')
+
+
+def temp_band_of(temp_f):
+    return int(temp_f // TEMP_BAND_WIDTH_F)
+
+
+# --- Incremental Build ---
+def update_sketches(conn, rebuild=False):
+    """Adds segments ingested since the last run to their cell sketches. Returns rows read."""
+    ensure_sketch_tables(conn)
+
+    last_rowid, max_rowid = start_job(conn, JOB, ['energy_quantile_sketches'], rebuild=rebuild)
+
+    touched = {}
+    processed = 0
+    for rows in iter_segment_batches(
+            conn, ['bus', 'date', 'activity_type', 'energy_used_kwh', 'duration_hours', 'mileage_miles',
+                   'average_temperature_f'],
+            last_rowid, max_rowid):
+        for rowid, bus, date, activity, energy, duration, miles, temp in rows:
+            processed += 1
+            if not is_driving_segment(activity, duration) or energy is None or temp is None or date is None:
+                continue
+            if isinstance(temp, float) and math.isnan(temp):
+                continue
+            cell = (str(bus), str(date)[:7], temp_band_of(temp))
+            values = {'avg_power_kw': energy / duration}
+            if miles and miles > 0:
+                values['kwh_per_mile'] = energy / miles
+            for metric, value in values.items():
+                key = (metric,) + cell
+                sketch = touched.get(key)
+                if sketch is None:
+                    row = conn.execute('''
+                        SELECT sketch FROM energy_quantile_sketches
+                        WHERE metric = ? AND bus = ? AND month = ? AND temp_band = ?
+                    ''', key).fetchone()
+                    sketch = QuantileSketch.from_json(row[0]) if row else QuantileSketch()
+                    touched[key] = sketch
+                sketch.add(value)
+
+    conn.executemany('''
+        INSERT OR REPLACE INTO energy_quantile_sketches (metric, bus, month, temp_band, count, sketch)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [key + (sketch.count, sketch.to_json()) for key, sketch in touched.items()])
+    finish_job(conn, JOB, max_rowid)
+    return processed
+
+
+# --- Query ---
+def query_percentiles(conn, metric, quantiles, buses=None, start_month=None, end_month=None,
+                      low_temp=None, high_temp=None, group_by_bus=False):
+    """Merges the matching cell sketches and returns percentiles.
+
+    Temperature filters select whole TEMP_BAND_WIDTH_F bands that overlap the range.
+    Returns {"all": {...}} or, with group_by_bus, {bus: {...}}; each entry has
+    "count" and one "pNN" value per requested quantile.
+    """
+    where = ["metric = ?"]
+    params = [metric]
+    if buses:
+        where.append(f"bus IN ({','.join(['?'] * len(buses))})")
+        params.extend(str(b) for b in buses)
+    if start_month:
+        where.append("month >= ?")
+        params.append(start_month)
+    if end_month:
+        where.append("month <= ?")
+        params.append(end_month)
+    if low_temp is not None:
+        where.append("temp_band >= ?")
+        params.append(temp_band_of(low_temp))
+    if high_temp is not None:
+        where.append("temp_band <= ?")
+        params.append(temp_band_of(high_temp))
+
+    merged = {}
+    cur = conn.execute(f"SELECT bus, sketch FROM energy_quantile_sketches WHERE {' AND '.join(where)}", params)
+    for bus, text in cur:
+        group = str(bus) if group_by_bus else 'all'
+        sketch = QuantileSketch.from_json(text)
+        if group in merged:
+            merged[group].merge(sketch)
+        else:
+            merged[group] = sketch
+
+    results = {}
+    for group, sketch in merged.items():
+        entry = {"count": sketch.count}
+        for q in quantiles:
+            value = sketch.quantile(q)
+            entry[f"p{q * 100:g}"] = round(value, 3) if value is not None else None
+        results[group] = entry
+    return results
+
+
+def run_for_source(source_id=DEFAULT_SOURCE_ID, rebuild=False):
+    return run_job_for_source(
+        source_id, 'operational_segments', update_sketches, rebuild=rebuild,
+        describe=lambda source, n: f"Quantile sketches for '{source}': read {n} new segments.")
+
+
+if __name__ == "__main__":
+    job_main("Incrementally build per-cell energy quantile sketches.", run_for_source,
+             "Drop all sketches and rebuild from every segment.")
@@ -0,0 +1,267 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import sys
+import time
+from datetime import datetime
+
+from simulation_kernel import (
+    KERNEL_VERSION, SLOTS, available_backends, run_simulation, run_simulation_batch,
+)
+
+# --- Configuration Constants ---
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(_APP_DIR, 'simulation_fixtures')
+GOLDEN_PATH = os.path.join(FIXTURES_DIR, f'golden_v{KERNEL_VERSION.split(".")[0]}.json')
+BENCHMARKS_PATH = os.path.join(FIXTURES_DIR, 'benchmarks.json')
+DEFAULT_CASES = 120
+DEFAULT_SEED = 20240501
+TOLERANCE = 1e-9
+
+# Golden fixtures for the simulation kernel (simulation_kernel_spec.json).
+# Cases are random run-cuts plus the edges the spec calls out: start SOCs at and
+# around the thresholds, null/missing/garbage SOCs, missing and invalid chargers,
+# Diesel buses and empty schedules. Expected results come from the reference
+# implementation; `check` runs every Python backend against them and
+# check_simulation_golden.js does the same for static/js/simulation.js.
+# Schedules are stored run-length encoded as [activity, chargerId, slots] and
+# expanded to the editor's per-slot {activity, chargerId} objects when loaded.
+
+_EDGE_SOCS = [0, 0.0001, 3, 5, 4.9999995, 5.0000005, 10, 20, 35.55, 99.9, 100, 120, -4,
+              None, 'missing', '', '42.5', 'abc']
+_ACTIVITIES = ['RUN', 'RUN', 'RUN', 'DEADHEAD', 'BREAK', 'CHARGE', 'CHARGE', None, 'LAYOVER']
+
+
+# --- Case Generation ---
+def _random_chargers(rng):
+    chargers = []
+    for n in range(rng.randint(0, 5)):
+        rate = rng.choice([150, 150, 450, 60.5, 0, -50, '180', None, 'fast'])
+        charger = {'id': rng.choice([f'CH{n}', n + 1, f'Depot-{n}'])}
+        if rate is not None:
+            charger['rate'] = rate
+        chargers.append(charger)
+    if chargers and rng.random() < 0.2:
+        chargers.append({'id': chargers[0]['id'], 'rate': 999})  # Duplicate ID: the first one wins
+    return chargers
+
+
+def _random_schedule(rng, chargers):
+    charger_ids = [c['id'] for c in chargers] + ['UNKNOWN', None, '']
+    runs = []
+    remaining = SLOTS if rng.random() > 0.1 else rng.randint(0, SLOTS - 1)  # Some schedules end early
+    while remaining > 0:
+        length = min(remaining, rng.randint(1, 16))
+        activity = rng.choice(_ACTIVITIES)
+        charger_id = rng.choice(charger_ids) if activity == 'CHARGE' else None
+        runs.append([activity, charger_id, length])
+        remaining -= length
+    return runs
+
+
+def _random_bus(rng, index, chargers):
+    bus = {'busId': rng.choice([f'B{index}', 26000 + index, f'{index}']), 'busType': 'BEB'}
+    soc = rng.choice(_EDGE_SOCS + [round(rng.uniform(0, 100), 3) for _ in range(6)])
+    if soc != 'missing':
+        bus['startSOC'] = soc
+    roll = rng.random()
+    if roll < 0.08:
+        bus['busType'] = 'Diesel'
+    elif roll < 0.12:
+        bus['schedule'] = None
+    elif roll < 0.15:
+        bus['schedule'] = []
+    else:
+        bus['schedule'] = _random_schedule(rng, chargers)
+    if rng.random() < 0.2:
+        bus['essCapacity'] = rng.choice([380.25, 300, 0, 'n/a'])
+    return bus
+
+
+def _random_parameters(rng):
+    roll = rng.random()
+    if roll < 0.03:
+        return {'essCapacity': 0, 'euRate': 100, 'warningThresholdLow': 20, 'warningThresholdCritical': 10}
+    if roll < 0.05:
+        return {'essCapacity': 435, 'euRate': '100', 'warningThresholdLow': 20, 'warningThresholdCritical': 10}
+    low = rng.choice([20, 25, 30, 17.5, 4])
+    return {
+        'essCapacity': rng.choice([435, 435, 525, 250.5, 100]),
+        'euRate': rng.choice([0, 60, 100, 137.7, 250, 800]),
+        'warningThresholdLow': low,
+        'warningThresholdCritical': rng.choice([10, 12.5, 5, 2, low + 5]),
+    }
+
+
+def generate_cases(count, seed):
+    rng = random.Random(seed)
+    cases = []
+    for n in range(count):
+        chargers = _random_chargers(rng)
+        buses = [_random_bus(rng, b, chargers) for b in range(rng.randint(0 if n % 40 == 0 else 1, 4))]
+        cases.append({
+            'id': f'case-{n:05d}',
+            'input': {
+                'runCutData': {'buses': buses},
+                'busParameters': _random_parameters(rng),
+                'availableChargers': chargers if rng.random() > 0.05 else None,
+            },
+        })
+    return cases
+
+
+def expand_input(case_input):
+    """Expands run-length encoded schedules into the per-slot entries the engines consume."""
+    buses = []
+    for bus in case_input['runCutData']['buses']:
+        bus = dict(bus)
+        if isinstance(bus.get('schedule'), list):
+            slots = []
+            for activity, charger_id, length in bus['schedule']:
+                entry = None if activity is None else {'activity': activity, 'chargerId': charger_id}
+                slots.extend([entry] * length)
+            bus['schedule'] = slots
+        buses.append(bus)
+    return dict(case_input, runCutData={'buses': buses})
+
+
+def _inputs(case):
+    expanded = expand_input(case['input'])
+    return expanded['runCutData'], expanded['busParameters'], expanded['availableChargers']
+
+
+# --- Comparison ---
+def compare(expected, actual, path='result'):
+    """First difference between two results as a message, or None. Numbers within TOLERANCE."""
+    if isinstance(expected, (int, float)) and isinstance(actual, (int, float)) \
+            and not isinstance(expected, bool) and not isinstance(actual, bool):
+        if math.isclose(expected, actual, rel_tol=0, abs_tol=TOLERANCE):
+            return None
+        return f"{path}: expected {expected!r}, got {actual!r}"
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        if set(expected) != set(actual):
+            return f"{path}: keys {sorted(expected)} != {sorted(actual)}"
+        for key in expected:
+            diff = compare(expected[key], actual[key], f"{path}.{key}")
+            if diff:
+                return diff
+        return None
+    if isinstance(expected, list) and isinstance(actual, list):
+        if len(expected) != len(actual):
+            return f"{path}: length {len(expected)} != {len(actual)}"
+        for i, (e, a) in enumerate(zip(expected, actual)):
+            diff = compare(e, a, f"{path}[{i}]")
+            if diff:
+                return diff
+        return None
+    return None if expected == actual else f"{path}: expected {expected!r}, got {actual!r}"
+
+
+# --- Commands ---
+def generate(count=DEFAULT_CASES, seed=DEFAULT_SEED, path=GOLDEN_PATH):
+    cases = generate_cases(count, seed)
+    for case in cases:
+        case['expected'] = run_simulation(*_inputs(case))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'kernel_version': KERNEL_VERSION, 'seed': seed, 'slots': SLOTS, 'cases': cases},
+                  f, separators=(',', ':'))
+        f.write('\n')
+    print(f"Wrote {len(cases)} golden cases for kernel {KERNEL_VERSION} to {path}")
+
+
+def check(path=GOLDEN_PATH, backends=None):
+    with open(path, 'r', encoding='utf-8') as f:
+        golden = json.load(f)
+    if golden['kernel_version'] != KERNEL_VERSION:
+        print(f"Error: fixtures are for kernel {golden['kernel_version']}, this is kernel {KERNEL_VERSION}. Regenerate them.")
+        return False
+
+    ok = True
+    for backend in backends or available_backends():
+        failures = 0
+        for case in golden['cases']:
+            actual = run_simulation_batch(*_inputs(case), backend=backend)
+            diff = compare(case['expected'], actual)
+            if diff:
+                failures += 1
+                if failures <= 5:
+                    print(f"  [{backend}] {case['id']}: {diff}")
+        print(f"{backend}: {len(golden['cases']) - failures}/{len(golden['cases'])} cases match")
+        ok = ok and failures == 0
+    return ok
+
+
+def bench(bus_days=5000, seed=DEFAULT_SEED, backends=None, record=False):
+    """Times each backend on one large run-cut; reports bus-days (one bus, one service day) per second."""
+    rng = random.Random(seed)
+    chargers = [{'id': f'CH{n}', 'rate': 150} for n in range(8)]
+    params = {'essCapacity': 435, 'euRate': 100, 'warningThresholdLow': 20, 'warningThresholdCritical': 10}
+    buses = []
+    for b in range(bus_days):
+        bus = {'busId': f'B{b}', 'busType': 'BEB', 'startSOC': rng.uniform(40, 100),
+               'schedule': _random_schedule(rng, chargers)}
+        buses.append(bus)
+    run_cut, params, chargers = _inputs({'input': {'runCutData': {'buses': buses},
+                                                   'busParameters': params, 'availableChargers': chargers}})
+
+    results = {}
+    for backend in backends or available_backends():
+        if backend == 'numba':
+            run_simulation_batch({'buses': run_cut['buses'][:1]}, params, chargers, backend='numba')  # JIT warm-up
+        started = time.perf_counter()
+        run_simulation_batch(run_cut, params, chargers, backend=backend)
+        elapsed = time.perf_counter() - started
+        results[backend] = round(bus_days / elapsed, 1)
+        print(f"{backend:>10}: {elapsed:8.3f}s  {results[backend]:>12,.1f} bus-days/s")
+
+    if record:
+        history = []
+        if os.path.exists(BENCHMARKS_PATH):
+            with open(BENCHMARKS_PATH, 'r', encoding='utf-8') as f:
+                history = json.load(f)
+        history.append({
+            'kernel_version': KERNEL_VERSION,
+            'recorded_at': datetime.now().isoformat(timespec='seconds'),
+            'bus_days': bus_days,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'bus_days_per_second': results,
+        })
+        os.makedirs(FIXTURES_DIR, exist_ok=True)
+        with open(BENCHMARKS_PATH, 'w', encoding='utf-8') as f:
+            json.dump(history, f, indent=2)
+            f.write('\n')
+        print(f"Recorded benchmark for kernel {KERNEL_VERSION} in {BENCHMARKS_PATH}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Golden fixtures and benchmarks for the simulation kernel.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    gen = sub.add_parser('generate', help="Regenerate the golden fixtures from the reference implementation.")
+    gen.add_argument('--count', type=int, default=DEFAULT_CASES, help="Number of random cases.")
+    gen.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    gen.add_argument('--output', default=GOLDEN_PATH, help="Fixture file to write.")
+
+    chk = sub.add_parser('check', help="Check every Python backend against the golden fixtures.")
+    chk.add_argument('--fixtures', default=GOLDEN_PATH)
+    chk.add_argument('--backend', action='append', choices=['reference', 'numpy', 'numba'],
+                     help="Backend to check (repeatable). Defaults to every installed backend.")
+
+    bn = sub.add_parser('bench', help="Measure simulation throughput per backend.")
+    bn.add_argument('--bus-days', type=int, default=5000)
+    bn.add_argument('--backend', action='append', choices=['reference', 'numpy', 'numba'])
+    bn.add_argument('--record', action='store_true', help="Append the result to simulation_fixtures/benchmarks.json.")
+
+    args = parser.parse_args()
+    if args.command == 'generate':
+        generate(args.count, args.seed, args.output)
+    elif args.command == 'check':
+        sys.exit(0 if check(args.fixtures, args.backend) else 1)
+    else:
+        bench(args.bus_days, backends=args.backend, record=args.record)
@@ -0,0 +1,483 @@
+import json
+import math
+import os
+from decimal import Decimal, ROUND_HALF_UP
+
+try:
+    import numpy as np
+except ImportError:  # The reference path below does not need NumPy.
+    np = None
+
+try:
+    import numba
+except ImportError:  # Optional: compiled kernel when numba is installed.
+    numba = None
+
+# --- Kernel Spec ---
+# Server-side implementation of the slot simulation in static/js/simulation.js
+# (runSimulation). The rules and constants live in simulation_kernel_spec.json;
+# both engines are checked against the golden fixtures built by
+# simulation_golden.py, so neither can drift from the spec unnoticed.
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+SPEC_PATH = os.path.join(_APP_DIR, 'simulation_kernel_spec.json')
+
+with open(SPEC_PATH, 'r', encoding='utf-8') as _f:
+    SPEC = json.load(_f)
+
+KERNEL_VERSION = SPEC['version']
+SLOTS = SPEC['constants']['slots']
+SLOT_DURATION_MINUTES = SPEC['constants']['slot_duration_minutes']
+SLOT_DURATION_HOURS = SLOT_DURATION_MINUTES / 60
+STRANDED_THRESHOLD = SPEC['constants']['stranded_threshold_percent']
+TRIGGER_EPS = SPEC['constants']['trigger_epsilon_percent']
+DEFAULT_START_SOC = SPEC['constants']['default_start_soc_percent']
+SOC_MIN = float(SPEC['constants']['soc_min_percent'])
+SOC_MAX = float(SPEC['constants']['soc_max_percent'])
+
+# Activity codes used by the array kernels.
+BREAK, RUN, DEADHEAD, CHARGE = 0, 1, 2, 3
+_ACTIVITY_CODES = {'RUN': RUN, 'DEADHEAD': DEADHEAD, 'CHARGE': CHARGE}
+_ACTIVITY_NAMES = {RUN: 'RUN', DEADHEAD: 'DEADHEAD'}
+
+_MISSING = object()
+
+
+# --- JavaScript Semantics Helpers ---
+# The inputs come from the browser as JSON, so coercions follow JavaScript.
+def _js_number(value):
+    """Number(value): null -> 0, missing -> NaN, numeric strings parsed."""
+    if value is _MISSING:
+        return math.nan
+    if value is None:
+        return 0.0
+    if isinstance(value, bool):
+        return 1.0 if value else 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        text = value.strip()
+        if not text:
+            return 0.0
+        try:
+            return float(text)
+        except ValueError:
+            return math.nan
+    return math.nan
+
+
+def _js_string(value):
+    """String(value) for the primitive types that appear in IDs."""
+    if value is _MISSING:
+        return 'undefined'
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _js_truthy(value):
+    if value is None or value is False or value == '':
+        return False
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value != 0 and not math.isnan(value)
+    return True
+
+
+def _is_js_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def to_fixed(value, digits=1):
+    """JavaScript Number.prototype.toFixed: rounds the exact binary value half away from zero."""
+    if math.isnan(value):
+        return 'NaN'
+    if value == 0:
+        value = 0.0  # (-0).toFixed() has no sign, unlike (-0.04).toFixed(1)
+    return str(Decimal(value).quantize(Decimal(1).scaleb(-digits), rounding=ROUND_HALF_UP))
+
+
+def minutes_to_time(total_minutes):
+    return f"{int(total_minutes // 60):02d}:{int(total_minutes % 60):02d}"
+
+
+# --- Input Handling ---
+def _validate(run_cut_data, bus_parameters):
+    if not isinstance(run_cut_data, dict) or not isinstance(run_cut_data.get('buses'), list) or not run_cut_data['buses']:
+        return "Simulation Error: No bus data provided."
+    p = bus_parameters if isinstance(bus_parameters, dict) else None
+    if (p is None
+            or not _is_js_number(p.get('essCapacity')) or p['essCapacity'] <= 0
+            or not _is_js_number(p.get('euRate')) or p['euRate'] < 0
+            or not _is_js_number(p.get('warningThresholdLow'))
+            or not _is_js_number(p.get('warningThresholdCritical'))):
+        return "Simulation Error: Invalid or missing bus parameters. Check Configuration."
+    return None
+
+
+def _bus_capacity(bus, fleet_ess_capacity):
+    own = _js_number(bus.get('essCapacity', _MISSING))
+    return own if math.isfinite(own) and own > 0 else fleet_ess_capacity
+
+
+def _start_soc(bus):
+    soc = _js_number(bus.get('startSOC', _MISSING))
+    return soc if math.isfinite(soc) else float(DEFAULT_START_SOC)
+
+
+def _diesel_result():
+    return {
+        'socTimeSeries': ['N/A'] * (SLOTS + 1),
+        'errors': ["Bus type is Diesel - simulation not applicable."],
+        'totalEnergyConsumedKWh': 'N/A',
+        'totalEnergyChargedKWh': 'N/A',
+        'triggerTimes': {'low': None, 'critical': None, 'stranded': None},
+        'isDiesel': True,
+    }
+
+
+def _charger_rate_lookup(available_chargers):
+    """String(id) -> Number(rate) for the first charger with that ID (Array.find semantics)."""
+    rates = {}
+    for charger in available_chargers:
+        if not isinstance(charger, dict):
+            continue
+        key = _js_string(charger.get('id', _MISSING))
+        if key not in rates:
+            rates[key] = _js_number(charger.get('rate', _MISSING))
+    return rates
+
+
+def _slot_entry(schedule, i):
+    entry = schedule[i] if i < len(schedule) else None
+    if not isinstance(entry, dict):
+        return 'BREAK', None
+    activity = entry.get('activity')
+    if not isinstance(activity, str) or not activity:
+        activity = 'BREAK'
+    charger_id = entry.get('chargerId')
+    return activity, charger_id
+
+
+def _charge_rate(charger_id, rates, errors, slot):
+    """Charger rate for a CHARGE slot, appending the same config/schedule errors as the JS engine."""
+    if _js_truthy(charger_id):
+        rate = rates.get(_js_string(charger_id), math.nan)
+        if math.isfinite(rate) and rate > 0:
+            return rate
+        needle = f'Charger ID "{_js_string(charger_id)}" missing/invalid'
+        if not any(needle in e for e in errors):
+            errors.append(f'Config Error: Charger ID "{_js_string(charger_id)}" missing/invalid in configuration.')
+    elif not any('CHARGE activity has no charger' in e for e in errors):
+        errors.append(f"Schedule Error at {minutes_to_time(slot * SLOT_DURATION_MINUTES)}: CHARGE activity has no charger assigned.")
+    return 0.0
+
+
+# --- Reference Implementation ---
+def run_simulation(run_cut_data, bus_parameters, available_chargers):
+    """Line-by-line port of runSimulation; the spec's reference semantics."""
+    results = {'resultsPerBus': {}, 'overallErrors': []}
+    error = _validate(run_cut_data, bus_parameters)
+    if error:
+        results['overallErrors'].append(error)
+        return results
+    if not isinstance(available_chargers, list):
+        available_chargers = []
+
+    fleet_ess = float(bus_parameters['essCapacity'])
+    eu_rate = float(bus_parameters['euRate'])
+    low_threshold = float(bus_parameters['warningThresholdLow'])
+    critical_threshold = float(bus_parameters['warningThresholdCritical'])
+    rates = _charger_rate_lookup(available_chargers)
+
+    for bus in run_cut_data['buses']:
+        bus = bus if isinstance(bus, dict) else {}
+        bus_key = _js_string(bus.get('busId', _MISSING))
+        if bus.get('busType') == 'Diesel':
+            results['resultsPerBus'][bus_key] = _diesel_result()
+            continue
+
+        ess = _bus_capacity(bus, fleet_ess)
+        result = {
+            'socTimeSeries': [], 'errors': [],
+            'totalEnergyConsumedKWh': 0.0, 'totalEnergyChargedKWh': 0.0,
+            'triggerTimes': {'low': None, 'critical': None, 'stranded': None},
+            'isDiesel': False,
+        }
+        results['resultsPerBus'][bus_key] = result
+        triggers = result['triggerTimes']
+        errors = result['errors']
+
+        schedule = bus.get('schedule') if isinstance(bus.get('schedule'), list) else []
+        soc = _start_soc(bus)
+        warned = {'low': False, 'critical': False, 'stranded': False}
+
+        for i in range(SLOTS):
+            result['socTimeSeries'].append(soc)
+            activity, charger_id = _slot_entry(schedule, i)
+            time_str = minutes_to_time(i * SLOT_DURATION_MINUTES)
+            energy = 0.0
+
+            if soc <= 0 and activity in ('RUN', 'DEADHEAD'):
+                if not warned['stranded']:
+                    errors.append(f"Stranded Alert at {time_str}: Attempted {activity} with 0% SOC.")
+                    warned['stranded'] = True
+                if triggers['stranded'] is None:
+                    triggers['stranded'] = i
+
+            if activity in ('RUN', 'DEADHEAD'):
+                if soc > 0:
+                    energy = -min(eu_rate * SLOT_DURATION_HOURS, (soc / 100) * ess)
+            elif activity == 'CHARGE':
+                potential = _charge_rate(charger_id, rates, errors, i) * SLOT_DURATION_HOURS
+                energy = min(potential, max(0, ((100 - soc) / 100) * ess))
+
+            if energy < 0:
+                result['totalEnergyConsumedKWh'] += abs(energy)
+            if energy > 0:
+                result['totalEnergyChargedKWh'] += energy
+
+            predicted = soc + (energy / ess) * 100
+            if predicted < STRANDED_THRESHOLD - TRIGGER_EPS and triggers['stranded'] is None:
+                triggers['stranded'] = i
+                if not warned['stranded']:
+                    errors.append(f"Stranded Alert at {time_str}: SOC < {_js_string(float(STRANDED_THRESHOLD))}% (pred {to_fixed(predicted)}%)")
+                    warned['stranded'] = True
+            if predicted < critical_threshold - TRIGGER_EPS and triggers['critical'] is None and triggers['stranded'] is None:
+                triggers['critical'] = i
+                if not warned['critical']:
+                    errors.append(f"Critical SOC at {time_str}: SOC < {_js_string(critical_threshold)}% (pred {to_fixed(predicted)}%)")
+                    warned['critical'] = True
+            if (predicted < low_threshold - TRIGGER_EPS and triggers['low'] is None
+                    and triggers['critical'] is None and triggers['stranded'] is None):
+                triggers['low'] = i
+                if not warned['low']:
+                    errors.append(f"Low SOC at {time_str}: SOC < {_js_string(low_threshold)}% (pred {to_fixed(predicted)}%)")
+                    warned['low'] = True
+
+            soc = max(SOC_MIN, min(SOC_MAX, predicted))
+
+        result['socTimeSeries'].append(soc)
+
+    return results
+
+
+# --- Array Kernels ---
+def _activity_row(schedule):
+    """Activity codes for the first SLOTS entries; anything that is not RUN/DEADHEAD/CHARGE is BREAK."""
+    codes = _ACTIVITY_CODES
+    return [
+        codes.get(entry.get('activity'), BREAK)
+        if isinstance(entry, dict) and isinstance(entry.get('activity'), str) else BREAK
+        for entry in schedule[:SLOTS]
+    ]
+
+
+def _prepare_batch(buses, fleet_ess, rates):
+    """Turns bus dicts into activity/charge-rate arrays plus schedule-only error events."""
+    codes = np.zeros((len(buses), SLOTS), dtype=np.int8)
+    charge_rates = np.zeros((len(buses), SLOTS), dtype=np.float64)
+    start_soc = np.empty(len(buses), dtype=np.float64)
+    ess = np.empty(len(buses), dtype=np.float64)
+    schedule_errors = []
+    for b, bus in enumerate(buses):
+        schedule = bus.get('schedule') if isinstance(bus.get('schedule'), list) else []
+        row = _activity_row(schedule)
+        codes[b, :len(row)] = row
+        errors = []
+        events = []
+        for i, code in enumerate(row):
+            if code == CHARGE:
+                before = len(errors)
+                charge_rates[b, i] = _charge_rate(schedule[i].get('chargerId'), rates, errors, i)
+                if len(errors) > before:
+                    events.append((i, 1, errors[-1]))
+        start_soc[b] = _start_soc(bus)
+        ess[b] = _bus_capacity(bus, fleet_ess)
+        schedule_errors.append(events)
+    return codes, charge_rates, start_soc, ess, schedule_errors
+
+
+def _simulate_arrays_numpy(codes, charge_rates, start_soc, ess, eu_rate, low, critical):
+    """Steps all buses together, one slot at a time, with the reference arithmetic."""
+    n = codes.shape[0]
+    soc = start_soc.copy()
+    series = np.empty((n, SLOTS + 1), dtype=np.float64)
+    consumed = np.zeros(n)
+    charged = np.zeros(n)
+    trigger_slot = np.full((n, 3), -1, dtype=np.int64)   # stranded, critical, low
+    trigger_pred = np.zeros((n, 3))
+    stranded_by_attempt = np.zeros(n, dtype=np.bool_)
+    thresholds = (STRANDED_THRESHOLD, critical, low)
+    demand = eu_rate * SLOT_DURATION_HOURS
+
+    for i in range(SLOTS):
+        series[:, i] = soc
+        code = codes[:, i]
+        driving = (code == RUN) | (code == DEADHEAD)
+
+        attempt = driving & (soc <= 0) & (trigger_slot[:, 0] < 0)
+        trigger_slot[attempt, 0] = i
+        stranded_by_attempt |= attempt
+
+        energy = np.where(driving & (soc > 0), -np.minimum(demand, (soc / 100) * ess), 0.0)
+        charge = np.minimum(charge_rates[:, i] * SLOT_DURATION_HOURS, np.maximum(0, ((100 - soc) / 100) * ess))
+        energy = np.where(code == CHARGE, charge, energy)
+        consumed += np.where(energy < 0, np.abs(energy), 0.0)
+        charged += np.where(energy > 0, energy, 0.0)
+
+        predicted = soc + (energy / ess) * 100
+        unset_higher = np.ones(n, dtype=np.bool_)
+        for k, threshold in enumerate(thresholds):
+            fire = (predicted < threshold - TRIGGER_EPS) & (trigger_slot[:, k] < 0) & unset_higher
+            trigger_slot[fire, k] = i
+            trigger_pred[fire, k] = predicted[fire]
+            unset_higher &= trigger_slot[:, k] < 0
+
+        soc = np.maximum(SOC_MIN, np.minimum(SOC_MAX, predicted))
+
+    series[:, SLOTS] = soc
+    return series, consumed, charged, trigger_slot, trigger_pred, stranded_by_attempt
+
+
+def _simulate_arrays_loop(codes, charge_rates, start_soc, ess, eu_rate, low, critical,
+                          series, consumed, charged, trigger_slot, trigger_pred, stranded_by_attempt):
+    """Scalar loop version of _simulate_arrays_numpy, compiled by numba when it is installed."""
+    demand = eu_rate * SLOT_DURATION_HOURS
+    for b in range(codes.shape[0]):
+        soc = start_soc[b]
+        cap = ess[b]
+        for i in range(SLOTS):
+            series[b, i] = soc
+            code = codes[b, i]
+            driving = code == RUN or code == DEADHEAD
+            if driving and soc <= 0 and trigger_slot[b, 0] < 0:
+                trigger_slot[b, 0] = i
+                stranded_by_attempt[b] = True
+            energy = 0.0
+            if driving and soc > 0:
+                available = (soc / 100) * cap
+                energy = -(demand if demand < available else available)
+            elif code == CHARGE:
+                potential = charge_rates[b, i] * SLOT_DURATION_HOURS
+                headroom = ((100 - soc) / 100) * cap
+                if headroom < 0:
+                    headroom = 0.0
+                energy = potential if potential < headroom else headroom
+            if energy < 0:
+                consumed[b] += -energy
+            if energy > 0:
+                charged[b] += energy
+            predicted = soc + (energy / cap) * 100
+            if predicted < STRANDED_THRESHOLD - TRIGGER_EPS and trigger_slot[b, 0] < 0:
+                trigger_slot[b, 0] = i
+                trigger_pred[b, 0] = predicted
+            if predicted < critical - TRIGGER_EPS and trigger_slot[b, 1] < 0 and trigger_slot[b, 0] < 0:
+                trigger_slot[b, 1] = i
+                trigger_pred[b, 1] = predicted
+            if predicted < low - TRIGGER_EPS and trigger_slot[b, 2] < 0 and trigger_slot[b, 1] < 0 and trigger_slot[b, 0] < 0:
+                trigger_slot[b, 2] = i
+                trigger_pred[b, 2] = predicted
+            soc = SOC_MAX if predicted > SOC_MAX else predicted
+            if soc < SOC_MIN:
+                soc = SOC_MIN
+        series[b, SLOTS] = soc
+
+
+_simulate_arrays_jit = numba.njit(cache=False)(_simulate_arrays_loop) if numba is not None else None
+
+
+def _simulate_arrays_compiled(codes, charge_rates, start_soc, ess, eu_rate, low, critical):
+    n = codes.shape[0]
+    series = np.empty((n, SLOTS + 1))
+    consumed = np.zeros(n)
+    charged = np.zeros(n)
+    trigger_slot = np.full((n, 3), -1, dtype=np.int64)
+    trigger_pred = np.zeros((n, 3))
+    stranded_by_attempt = np.zeros(n, dtype=np.bool_)
+    _simulate_arrays_jit(codes, charge_rates, start_soc, ess, float(eu_rate), float(low), float(critical),
+                         series, consumed, charged, trigger_slot, trigger_pred, stranded_by_attempt)
+    return series, consumed, charged, trigger_slot, trigger_pred, stranded_by_attempt
+
+
+def available_backends():
+    backends = ['reference']
+    if np is not None:
+        backends.append('numpy')
+    if _simulate_arrays_jit is not None:
+        backends.append('numba')
+    return backends
+
+
+def run_simulation_batch(run_cut_data, bus_parameters, available_chargers, backend=None):
+    """Same inputs and output as run_simulation, computed with the array kernels.
+
+    backend: 'numba' (default when installed), 'numpy', or 'reference'.
+    """
+    backend = backend or ('numba' if _simulate_arrays_jit is not None else 'numpy')
+    if backend == 'reference' or np is None:
+        return run_simulation(run_cut_data, bus_parameters, available_chargers)
+    if backend == 'numba' and _simulate_arrays_jit is None:
+        raise ValueError("The numba backend requires numba to be installed.")
+
+    results = {'resultsPerBus': {}, 'overallErrors': []}
+    error = _validate(run_cut_data, bus_parameters)
+    if error:
+        results['overallErrors'].append(error)
+        return results
+    if not isinstance(available_chargers, list):
+        available_chargers = []
+
+    buses = [bus if isinstance(bus, dict) else {} for bus in run_cut_data['buses']]
+    electric = [bus for bus in buses if bus.get('busType') != 'Diesel']
+    low = float(bus_parameters['warningThresholdLow'])
+    critical = float(bus_parameters['warningThresholdCritical'])
+
+    codes, charge_rates, start_soc, ess, schedule_errors = _prepare_batch(
+        electric, float(bus_parameters['essCapacity']), _charger_rate_lookup(available_chargers))
+    simulate = _simulate_arrays_compiled if backend == 'numba' else _simulate_arrays_numpy
+    series, consumed, charged, trigger_slot, trigger_pred, by_attempt = simulate(
+        codes, charge_rates, start_soc, ess, float(bus_parameters['euRate']), low, critical)
+
+    labels = (
+        ('stranded', 'Stranded Alert', float(STRANDED_THRESHOLD)),
+        ('critical', 'Critical SOC', critical),
+        ('low', 'Low SOC', low),
+    )
+    electric_index = 0
+    for bus in buses:
+        bus_key = _js_string(bus.get('busId', _MISSING))
+        if bus.get('busType') == 'Diesel':
+            results['resultsPerBus'][bus_key] = _diesel_result()
+            continue
+        b = electric_index
+        electric_index += 1
+
+        # Messages are ordered as the JS engine emits them: by slot, then
+        # stranded attempt, charger errors, stranded, critical, low.
+        events = list(schedule_errors[b])
+        triggers = {}
+        for k, (name, label, threshold) in enumerate(labels):
+            slot = int(trigger_slot[b, k])
+            triggers[name] = slot if slot >= 0 else None
+            if slot < 0:
+                continue
+            time_str = minutes_to_time(slot * SLOT_DURATION_MINUTES)
+            if k == 0 and by_attempt[b]:
+                activity = _ACTIVITY_NAMES[int(codes[b, slot])]
+                events.append((slot, 0, f"Stranded Alert at {time_str}: Attempted {activity} with 0% SOC."))
+            else:
+                events.append((slot, 2 + k, f"{label} at {time_str}: SOC < {_js_string(threshold)}% (pred {to_fixed(float(trigger_pred[b, k]))}%)"))
+        events.sort(key=lambda e: (e[0], e[1]))
+
+        results['resultsPerBus'][bus_key] = {
+            'socTimeSeries': series[b].tolist(),
+            'errors': [message for _, _, message in events],
+            'totalEnergyConsumedKWh': float(consumed[b]),
+            'totalEnergyChargedKWh': float(charged[b]),
+            'triggerTimes': triggers,
+            'isDiesel': False,
+        }
+    return results
@@ -11,6 +11,8 @@ const SLOTS = window.SLOTS ?? 96;
 const SLOT_DURATION_MINUTES = 15;
 const SLOT_DURATION_HOURS = SLOT_DURATION_MINUTES / 60;
 const STRANDED_THRESHOLD = 5; // %
+// Version of bus_sim_back/simulation_kernel_spec.json these engines implement.
+const SIMULATION_KERNEL_VERSION = '1.0.0';
 
 function runSimulation(runCutData, busParameters, availableChargers) {
   console.log("Starting simulation (Handles Diesel/Deadhead)...");
@@ -35,7 +37,7 @@ function runSimulation(runCutData, busParameters, availableChargers) {
     availableChargers = [];
   }
 
-  const essCapacity = busParameters.essCapacity;
+  const fleetEssCapacity = busParameters.essCapacity;
   const euRate = busParameters.euRate; // kWh per hour during RUN/DEADHEAD
   const lowThreshold = busParameters.warningThresholdLow;
   const criticalThreshold = busParameters.warningThresholdCritical;
@@ -55,6 +57,7 @@ function runSimulation(runCutData, busParameters, availableChargers) {
     }
 
     console.log(`Simulating BEB bus: ${bus.busName || bus.busId}`);
+    const essCapacity = resolveBusCapacity(bus, fleetEssCapacity);
     const busResult = {
       socTimeSeries: [],
       errors: [],
@@ -164,17 +167,311 @@ function runSimulation(runCutData, busParameters, availableChargers) {
   return results;
 }
 
+// Per-bus capacity (e.g. the estimate from /api/bus_capacity) overrides the fleet-wide value.
+function resolveBusCapacity(bus, fleetEssCapacity) {
+  const own = Number(bus?.essCapacity);
+  return Number.isFinite(own) && own > 0 ? own : fleetEssCapacity;
+}
+
 function minutesToTimeSim(totalMinutes) {
   const hours = Math.floor(totalMinutes / 60).toString().padStart(2, '0');
   const minutes = (totalMinutes % 60).toString().padStart(2, '0');
   return `${hours}:${minutes}`;
 }
 
+// ---------------- Event-driven engine ----------------
+// Advances only at activity boundaries. Between two boundaries SOC is linear
+// (RUN/DEADHEAD drain at euRate, CHARGE fills at the charger rate, BREAK is flat)
+// and clamped to [0, 100], so each event is solved in closed form. Cost grows
+// with the number of activity changes, not with the time resolution.
+//
+// Bus input: either `schedule` (slot grid, same as runSimulation) or
+// `events: [{ start, end, activity, chargerId }]` where start/end are minutes
+// from the start of the day, "HH:MM[:SS]" strings, or Date/ISO timestamps
+// (measured from runCutData.origin, defaulting to local midnight of the first event).
+// Results keep the runSimulation shape (socTimeSeries / triggerTimes on the slot
+// grid) and add exact `triggerMinutes` plus `socBreakpoints` [{ minute, soc }].
+
+function timeToMinutesSim(value, originMs) {
+  if (typeof value === 'number') return value;
+  if (typeof value === 'string') {
+    const m = value.trim().match(/^(\d{1,2}):(\d{2})(?::(\d{2}))?$/);
+    if (m) return Number(m[1]) * 60 + Number(m[2]) + Number(m[3] || 0) / 60;
+  }
+  const ms = value instanceof Date ? value.getTime() : Date.parse(value);
+  if (!Number.isFinite(ms) || originMs === null) return NaN;
+  return (ms - originMs) / 60000;
+}
+
+function resolveOriginMs(runCutData) {
+  if (runCutData.origin !== undefined && runCutData.origin !== null) {
+    const ms = runCutData.origin instanceof Date ? runCutData.origin.getTime() : Date.parse(runCutData.origin);
+    if (Number.isFinite(ms)) return ms;
+  }
+  for (const bus of runCutData.buses) {
+    for (const ev of (Array.isArray(bus.events) ? bus.events : [])) {
+      const v = ev?.start;
+      if (typeof v === 'number' || (typeof v === 'string' && /^\d{1,2}:\d{2}/.test(v.trim()))) continue;
+      const d = v instanceof Date ? new Date(v.getTime()) : new Date(v);
+      if (Number.isFinite(d.getTime())) { d.setHours(0, 0, 0, 0); return d.getTime(); }
+    }
+  }
+  return null;
+}
+
+// Collapse a slot-grid schedule into run-length events.
+function scheduleToEvents(schedule, slots = SLOTS) {
+  const events = [];
+  for (let i = 0; i < slots; i++) {
+    const entry = (Array.isArray(schedule) ? schedule[i] : null) || null;
+    const activity = entry?.activity || 'BREAK';
+    const chargerId = entry?.chargerId ?? null;
+    const last = events[events.length - 1];
+    if (last && last.activity === activity && String(last.chargerId) === String(chargerId)) {
+      last.end += SLOT_DURATION_MINUTES;
+    } else {
+      events.push({ start: i * SLOT_DURATION_MINUTES, end: (i + 1) * SLOT_DURATION_MINUTES, activity, chargerId });
+    }
+  }
+  return events;
+}
+
+function runSimulationEventDriven(runCutData, busParameters, availableChargers, options = {}) {
+  console.log("Starting event-driven simulation...");
+
+  const results = { resultsPerBus: {}, overallErrors: [] };
+
+  if (!runCutData || !Array.isArray(runCutData.buses) || runCutData.buses.length === 0) {
+    results.overallErrors.push("Simulation Error: No bus data provided.");
+    return results;
+  }
+  if (!busParameters
+      || typeof busParameters.essCapacity !== 'number' || busParameters.essCapacity <= 0
+      || typeof busParameters.euRate !== 'number' || busParameters.euRate < 0
+      || typeof busParameters.warningThresholdLow !== 'number'
+      || typeof busParameters.warningThresholdCritical !== 'number') {
+    results.overallErrors.push("Simulation Error: Invalid or missing bus parameters. Check Configuration.");
+    return results;
+  }
+  if (!availableChargers || !Array.isArray(availableChargers)) {
+    console.warn("Simulation Warning: No available charger data provided.");
+    availableChargers = [];
+  }
+
+  const fleetEssCapacity = busParameters.essCapacity;
+  const euRate = busParameters.euRate;
+  const lowThreshold = busParameters.warningThresholdLow;
+  const criticalThreshold = busParameters.warningThresholdCritical;
+  const slots = options.slots ?? SLOTS;
+  const gridEndMinute = slots * SLOT_DURATION_MINUTES;
+  const originMs = resolveOriginMs(runCutData);
+  const eps = 1e-6;
+
+  // First match wins, like the availableChargers.find() lookup in runSimulation.
+  const chargerRates = new Map();
+  availableChargers.forEach(c => { if (!chargerRates.has(String(c.id))) chargerRates.set(String(c.id), Number(c.rate)); });
+
+  runCutData.buses.forEach(bus => {
+    if (bus.busType === 'Diesel') {
+      results.resultsPerBus[bus.busId] = {
+        socTimeSeries: Array(slots + 1).fill('N/A'),
+        errors: ["Bus type is Diesel - simulation not applicable."],
+        totalEnergyConsumedKWh: 'N/A',
+        totalEnergyChargedKWh: 'N/A',
+        triggerTimes: { low: null, critical: null, stranded: null },
+        triggerMinutes: { low: null, critical: null, stranded: null },
+        socBreakpoints: [],
+        isDiesel: true
+      };
+      return;
+    }
+
+    const essCapacity = resolveBusCapacity(bus, fleetEssCapacity);
+    const busResult = {
+      socTimeSeries: [],
+      errors: [],
+      totalEnergyConsumedKWh: 0,
+      totalEnergyChargedKWh: 0,
+      triggerTimes: { low: null, critical: null, stranded: null },
+      triggerMinutes: { low: null, critical: null, stranded: null },
+      socBreakpoints: [],
+      isDiesel: false
+    };
+    results.resultsPerBus[bus.busId] = busResult;
+
+    // Normalise events: minutes, sorted, non-overlapping, gaps filled with BREAK.
+    const rawEvents = Array.isArray(bus.events) ? bus.events : scheduleToEvents(bus.schedule, slots);
+    const events = [];
+    rawEvents
+      .map(ev => ({
+        start: timeToMinutesSim(ev?.start, originMs),
+        end: timeToMinutesSim(ev?.end, originMs),
+        activity: ev?.activity || 'BREAK',
+        chargerId: ev?.chargerId ?? null
+      }))
+      .filter(ev => {
+        const ok = Number.isFinite(ev.start) && Number.isFinite(ev.end) && ev.end > ev.start;
+        if (!ok) busResult.errors.push(`Schedule Error: Ignored event with invalid time range (${ev.activity}).`);
+        return ok;
+      })
+      .sort((a, b) => a.start - b.start)
+      .forEach(ev => {
+        const cursor = events.length ? events[events.length - 1].end : 0;
+        if (ev.start > cursor) events.push({ start: cursor, end: ev.start, activity: 'BREAK', chargerId: null });
+        const start = Math.max(ev.start, cursor);
+        if (ev.end > start) events.push({ ...ev, start });
+      });
+    const lastEnd = events.length ? events[events.length - 1].end : 0;
+    if (lastEnd < gridEndMinute) events.push({ start: lastEnd, end: gridEndMinute, activity: 'BREAK', chargerId: null });
+
+    let currentSOC = Number(bus.startSOC);
+    if (!Number.isFinite(currentSOC)) currentSOC = 90;
+    // Out-of-range start SOCs are clamped up front; interpolating from e.g. 120%
+    // would book the clamp as consumed energy and sample SOCs above 100%.
+    currentSOC = Math.max(0, Math.min(100, currentSOC));
+
+    const triggers = busResult.triggerMinutes;
+    const thresholds = [
+      { key: 'stranded', value: STRANDED_THRESHOLD, label: 'Stranded Alert' },
+      { key: 'critical', value: criticalThreshold, label: 'Critical SOC' },
+      { key: 'low', value: lowThreshold, label: 'Low SOC' }
+    ];
+    // A trigger only fires while every higher-precedence trigger is still unset.
+    const recordTrigger = (index, minute, predSOC) => {
+      const t = thresholds[index];
+      for (let k = 0; k < index; k++) {
+        const higher = triggers[thresholds[k].key];
+        if (higher !== null && higher <= minute) return;
+      }
+      triggers[t.key] = minute;
+      busResult.errors.push(`${t.label} at ${minutesToTimeSim(Math.floor(minute))}: SOC < ${t.value}% (pred ${predSOC.toFixed(1)}%)`);
+    };
+
+    busResult.socBreakpoints.push({ minute: events.length ? events[0].start : 0, soc: currentSOC });
+
+    events.forEach(ev => {
+      const durationHours = (ev.end - ev.start) / 60;
+      const timeStr = minutesToTimeSim(Math.floor(ev.start));
+      let ratePctPerMinute = 0;
+
+      switch (ev.activity) {
+        case 'RUN':
+        case 'DEADHEAD': {
+          if (currentSOC <= 0) {
+            if (triggers.stranded === null) {
+              triggers.stranded = ev.start;
+              busResult.errors.push(`Stranded Alert at ${timeStr}: Attempted ${ev.activity} with 0% SOC.`);
+            }
+          }
+          ratePctPerMinute = -(euRate / 60) / essCapacity * 100;
+          break;
+        }
+        case 'CHARGE': {
+          let rate = 0;
+          if (ev.chargerId) {
+            const r = chargerRates.get(String(ev.chargerId));
+            if (Number.isFinite(r) && r > 0) {
+              rate = r;
+            } else if (!busResult.errors.some(e => e.includes(`Charger ID "${ev.chargerId}" missing/invalid`))) {
+              busResult.errors.push(`Config Error: Charger ID "${ev.chargerId}" missing/invalid in configuration.`);
+            }
+          } else if (!busResult.errors.some(e => e.includes('CHARGE activity has no charger'))) {
+            busResult.errors.push(`Schedule Error at ${timeStr}: CHARGE activity has no charger assigned.`);
+          }
+          ratePctPerMinute = (rate / 60) / essCapacity * 100;
+          break;
+        }
+        case 'BREAK':
+        default:
+          ratePctPerMinute = 0;
+      }
+
+      const startSOC = currentSOC;
+      const unclamped = startSOC + ratePctPerMinute * (ev.end - ev.start);
+      const endSOC = Math.max(0, Math.min(100, unclamped));
+      const deltaKWh = ((endSOC - startSOC) / 100) * essCapacity;
+      if (deltaKWh < 0) busResult.totalEnergyConsumedKWh += -deltaKWh;
+      if (deltaKWh > 0) busResult.totalEnergyChargedKWh += deltaKWh;
+
+      // SOC is monotone inside an event, so the lowest point is one of its ends.
+      thresholds
+        .map((t, index) => {
+          if (triggers[t.key] !== null || !(Math.min(startSOC, endSOC) < t.value - eps)) return null;
+          const minute = (startSOC <= t.value || ratePctPerMinute === 0)
+            ? ev.start
+            : ev.start + (t.value - startSOC) / ratePctPerMinute;
+          return { index, minute };
+        })
+        .filter(Boolean)
+        .sort((a, b) => a.minute - b.minute || a.index - b.index)
+        .forEach(c => {
+          // Like runSimulation, report the unclamped SOC predicted for the end of the
+          // slot containing the trigger minute (or of the event, if that comes first).
+          const slotEnd = (Math.floor(c.minute / SLOT_DURATION_MINUTES) + 1) * SLOT_DURATION_MINUTES;
+          recordTrigger(c.index, c.minute, startSOC + ratePctPerMinute * (Math.min(slotEnd, ev.end) - ev.start));
+        });
+
+      // Breakpoint where SOC hits a clamp before the event ends.
+      if (ratePctPerMinute !== 0 && endSOC !== unclamped) {
+        const hitMinute = ev.start + (endSOC - startSOC) / ratePctPerMinute;
+        if (hitMinute > ev.start && hitMinute < ev.end) busResult.socBreakpoints.push({ minute: hitMinute, soc: endSOC });
+      }
+      busResult.socBreakpoints.push({ minute: ev.end, soc: endSOC });
+      currentSOC = endSOC;
+    });
+
+    busResult.socTimeSeries = sampleBreakpoints(busResult.socBreakpoints, slots);
+
+    // Slot-grid triggers follow runSimulation: slot i fires when the SOC at the
+    // end of the slot is below the threshold, and within one slot stranded beats
+    // critical beats low. Dips that start and recover between two grid samples
+    // fall back to the slot containing the exact trigger minute.
+    const series = busResult.socTimeSeries;
+    const slotFor = (key, value) => {
+      for (let i = 0; i < slots; i++) {
+        if (series[i + 1] < value - eps) return i;
+      }
+      const minute = triggers[key];
+      if (minute === null || minute % SLOT_DURATION_MINUTES === 0) return null;
+      return Math.max(0, Math.floor(minute / SLOT_DURATION_MINUTES));
+    };
+    const strandedSlot = slotFor('stranded', STRANDED_THRESHOLD);
+    let criticalSlot = slotFor('critical', criticalThreshold);
+    if (criticalSlot !== null && strandedSlot !== null && strandedSlot <= criticalSlot) criticalSlot = null;
+    let lowSlot = slotFor('low', lowThreshold);
+    if (lowSlot !== null && ((strandedSlot !== null && strandedSlot <= lowSlot) || (criticalSlot !== null && criticalSlot <= lowSlot))) lowSlot = null;
+    busResult.triggerTimes = { low: lowSlot, critical: criticalSlot, stranded: strandedSlot };
+  });
+
+  console.log("Event-driven simulation finished.");
+  return results;
+}
+
+// Render piecewise-linear SOC breakpoints onto the slot grid (slots + 1 samples).
+function sampleBreakpoints(breakpoints, slots = SLOTS) {
+  const series = [];
+  if (!breakpoints.length) return series;
+  let j = 0;
+  for (let i = 0; i <= slots; i++) {
+    const minute = i * SLOT_DURATION_MINUTES;
+    while (j < breakpoints.length - 1 && breakpoints[j + 1].minute <= minute) j++;
+    const a = breakpoints[j];
+    const b = breakpoints[j + 1];
+    if (!b || minute <= a.minute) {
+      series.push(a.soc);
+    } else {
+      series.push(a.soc + (b.soc - a.soc) * (minute - a.minute) / (b.minute - a.minute));
+    }
+  }
+  return series;
+}
+
 // ---------------- Editor adapter ----------------
 
 (function(){
-  // Keep the original engine ref
+  // Keep the original engine refs; window.SIMULATION_MODE = 'event' opts into the event-driven engine
   const engineRunSimulation = runSimulation;
+  const engineRunSimulationEventDriven = runSimulationEventDriven;
 
   function showResultsHTML(html){
     const box = document.getElementById('simulation-results-container');
@@ -219,6 +516,21 @@ function minutesToTimeSim(totalMinutes) {
     }));
   }
 
+  // Opt-in (window.USE_ESTIMATED_CAPACITY): per-bus capacity estimates keyed by real bus ID.
+  async function resolveBusCapacities(){
+    if (!window.USE_ESTIMATED_CAPACITY) return {};
+    try{
+      const res = await fetch('/api/bus_capacity');
+      if (!res.ok) return {};
+      const payload = await res.json();
+      const out = {};
+      Object.entries(payload?.buses || {}).forEach(([busId, info]) => {
+        if (typeof info?.current_capacity_kwh === 'number') out[busId] = info.current_capacity_kwh;
+      });
+      return out;
+    } catch { return {}; }
+  }
+
   function toRunCutData(editorState){
     const slots = window.SLOTS ?? 96;
     const store = editorState?.data || window.scheduleData || {};
@@ -239,6 +551,7 @@ function minutesToTimeSim(totalMinutes) {
         busName: busId,
         busType: b.type || b.busType || 'EV',
         startSOC: Number.isFinite(Number(b.soc ?? b.startSOC)) ? Number(b.soc ?? b.startSOC) : 90,
+        essCapacity: Number(b.essCapacity) || null,
         schedule
       };
     });
@@ -251,8 +564,14 @@ function minutesToTimeSim(totalMinutes) {
       const runCutData       = toRunCutData(editorState);
       const busParameters    = await resolveBusParameters();
       const availableChargers= await resolveChargers();
+      const busCapacities    = await resolveBusCapacities();
+      runCutData.buses.forEach(bus => {
+        if (!bus.essCapacity && busCapacities[bus.busId]) bus.essCapacity = busCapacities[bus.busId];
+      });
 
-      const results = engineRunSimulation(runCutData, busParameters, availableChargers);
+      const results = window.SIMULATION_MODE === 'event'
+        ? engineRunSimulationEventDriven(runCutData, busParameters, availableChargers)
+        : engineRunSimulation(runCutData, busParameters, availableChargers);
 
       // Simple readable summary (you can replace with charts later)
       const busIds = Object.keys(results.resultsPerBus || {});
@@ -0,0 +1,68 @@
+# Gunicorn settings for Render / Procfile deploys.
+# - The app is imported once in the master (preload_app) and shared copy-on-write
+#   with the workers, so each worker skips the Flask/app import on boot.
+# - init_db() runs once here instead of on every worker boot.
+# - A startup report logs master load time and per-worker boot time and RSS.
+# - Threaded workers, so long streamed exports are not killed by the worker timeout.
+import os
+import time
+
+preload_app = (os.environ.get('GUNICORN_PRELOAD', '1').strip() != '0')
+
+# Streamed exports (/api/export/*) can take minutes for a multi-gigabyte shard.
+# The default sync worker stops heartbeating while it writes a response, so the
+# master kills it after `timeout` seconds (WORKER TIMEOUT) and the download is
+# cut off mid-stream. gthread workers heartbeat from their main loop while
+# request threads stream, so `timeout` only catches workers that are actually
+# stuck.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+
+_MASTER_STARTED = time.perf_counter()
+
+
+def _rss_mb():
+    """Resident set size of the current process in MB (Linux /proc, else peak RSS)."""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    except (ImportError, AttributeError):
+        return None
+
+
+def when_ready(server):
+    # Runs in the master after the app is (pre)loaded and before workers are forked.
+    import app as bus_sim_app
+    init_started = time.perf_counter()
+    bus_sim_app.init_db()
+    rss = _rss_mb()
+    server.log.info(
+        "startup: master ready in %.1f ms (app import %.1f ms, init_db %.1f ms, preload=%s, rss=%s MB)",
+        (time.perf_counter() - _MASTER_STARTED) * 1000,
+        bus_sim_app.APP_IMPORT_SECONDS * 1000,
+        (time.perf_counter() - init_started) * 1000,
+        preload_app,
+        f"{rss:.1f}" if rss is not None else "n/a",
+    )
+
+
+def pre_fork(server, worker):
+    worker._boot_started = time.perf_counter()
+
+
+def post_worker_init(worker):
+    rss = _rss_mb()
+    worker.log.info(
+        "startup: worker %s booted in %.1f ms (rss=%s MB)",
+        worker.pid,
+        (time.perf_counter() - getattr(worker, '_boot_started', time.perf_counter())) * 1000,
+        f"{rss:.1f}" if rss is not None else "n/a",
+    )